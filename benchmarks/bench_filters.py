@@ -0,0 +1,49 @@
+"""Benchmark the filters which have a fast path in django_cofingo.filters
+against the original implementations, on user generated text without and
+with markup.
+"""
+import warnings
+
+from utils import bench, configure
+
+configure()
+
+from django.template.defaultfilters import register
+from django.utils.text import truncate_html_words
+from jinja2 import filters as jinja_filters
+from jinja2.nodes import EvalContext
+from django_cofingo import env
+from django_cofingo import filters
+from django_cofingo.utils import django_filter_to_jinja2
+
+warnings.simplefilter('ignore', PendingDeprecationWarning)
+
+PLAIN = u' '.join([u'Lorem ipsum dolor sit amet, consectetur adipiscing '
+                   u'elit. Sed do eiusmod tempor incididunt ut labore.'] * 20)
+MARKUP = PLAIN.replace(u'amet, ', u'amet,\n\n<b>visit</b> www.example.com ')
+
+django_linebreaks = django_filter_to_jinja2(register.filters['linebreaks'])
+eval_ctx = EvalContext(env)
+
+FILTERS = [
+    ('linebreaks', lambda value: filters.library.filters['linebreaks'](
+        env, value), lambda value: django_linebreaks(env, value)),
+    ('urlize', lambda value: filters.library.filters['urlize'](
+        eval_ctx, value), lambda value: jinja_filters.do_urlize(
+            eval_ctx, value)),
+    ('truncatewords_html', lambda value: filters.library.filters[
+        'truncatewords_html'](value, 1000), lambda value: truncate_html_words(
+            value, 1000)),
+]
+
+
+def main():
+    for name, fast, original in FILTERS:
+        for text_name, text in (('plain', PLAIN), ('markup', MARKUP)):
+            bench('%s %s (cofingo)' % (name, text_name), lambda: fast(text))
+            bench('%s %s (original)' % (name, text_name),
+                  lambda: original(text))
+
+
+if __name__ == '__main__':
+    main()
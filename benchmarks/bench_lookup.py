@@ -0,0 +1,45 @@
+"""Benchmark attribute and item lookups in loops over model instances and
+dicts, these go through ``Environment.getattr`` and ``Environment.getitem``.
+A plain Jinja2 environment is included as reference.
+"""
+import jinja2
+
+from utils import bench, configure
+
+configure()
+
+from django.contrib.auth.models import User
+from django_cofingo import env
+
+COUNT = 1000
+
+SOURCES = [
+    ('attribute', '{% for o in items %}{{ o.username }}{{ o.email }}'
+                  '{{ o.first_name }}{% endfor %}'),
+    ('subscript', "{% for o in items %}{{ o['username'] }}{{ o['email'] }}"
+                  "{{ o['first_name'] }}{% endfor %}"),
+]
+
+CONTEXTS = [
+    ('models', [User(username='user%d' % i, email='user%d@example.com' % i,
+                     first_name='User') for i in range(COUNT)]),
+    ('dicts', [{'username': 'user%d' % i, 'email': 'user%d@example.com' % i,
+                'first_name': 'User'} for i in range(COUNT)]),
+]
+
+
+def main():
+    reference = jinja2.Environment(autoescape=True)
+    for source_name, source in SOURCES:
+        for context_name, items in CONTEXTS:
+            if source_name == 'subscript' and context_name == 'models':
+                continue
+            for env_name, environment in (('cofingo', env),
+                                          ('jinja2', reference)):
+                template = environment.from_string(source)
+                name = '%s %s (%s)' % (source_name, context_name, env_name)
+                bench(name, lambda: template.render({'items': items}))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""Render throughput of the shared module level environment when it is used
+from several threads and from several processes. Templates of the test apps
+are loaded through ``django_cofingo.Loader`` and rendered with
+``Template.render``, like Django does for every request.
+
+Usage::
+
+    python benchmarks/bench_threads.py [--workers 1,2,4,8] [--renders 2000]
+
+For every number of workers the throughput, the latency percentiles and
+the scaling relative to a single worker are reported, as well as the CPU
+time of the workers per second of wall time. Threads which wait for the GIL
+use about one CPU second per second together, however many there are;
+``waiting`` is the share of the time a worker was not running (on the GIL
+for threads, on a free CPU for processes).
+"""
+import multiprocessing
+import os
+import threading
+import time
+from optparse import OptionParser
+
+from utils import configure
+
+configure()
+
+from django_cofingo import Loader
+
+TEMPLATES = [
+    ('fullstack_app/index.html', {}),
+    ('fullstack_app/child.html', {'name': 'Child', 'content': lambda: 'x'}),
+]
+
+
+def cpu_time(children=False):
+    """Return the user and system time of this process, or of its children
+    which have been waited for.
+    """
+    times = os.times()
+    if children:
+        return times[2] + times[3]
+    return times[0] + times[1]
+
+
+def render(renders, latencies):
+    loader = Loader()
+    for i in xrange(renders):
+        name, context = TEMPLATES[i % len(TEMPLATES)]
+        start = time.time()
+        template, origin = loader.load_template(name)
+        template.render(dict(context))
+        latencies.append(time.time() - start)
+
+
+def render_process(renders, queue):
+    latencies = []
+    render(renders, latencies)
+    queue.put(latencies)
+
+
+def run_threads(workers, renders):
+    latencies = []
+    threads = [threading.Thread(target=render, args=(renders, latencies))
+               for i in range(workers)]
+    start = time.time()
+    cpu_start = cpu_time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.time() - start, cpu_time() - cpu_start, latencies
+
+
+def run_processes(workers, renders):
+    queue = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=render_process,
+                                         args=(renders, queue))
+                 for i in range(workers)]
+    start = time.time()
+    cpu_start = cpu_time(children=True)
+    for process in processes:
+        process.start()
+    latencies = []
+    for process in processes:
+        latencies.extend(queue.get())
+    elapsed = time.time() - start
+    for process in processes:
+        process.join()
+    return elapsed, cpu_time(children=True) - cpu_start, latencies
+
+
+def percentile(values, percent):
+    return values[min(int(len(values) * percent / 100.0), len(values) - 1)]
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--workers', default='1,2,4,8',
+                      help='comma separated numbers of workers')
+    parser.add_option('--renders', type='int', default=2000,
+                      help='renders per worker')
+    options, args = parser.parse_args()
+    workers = [int(count) for count in options.workers.split(',')]
+
+    # Compile the templates before measuring
+    render(len(TEMPLATES), [])
+
+    print('%-9s %7s %10s %8s %8s %8s %8s %8s %8s' % (
+        'mode', 'workers', 'renders/s', 'scaling', 'p50 ms', 'p90 ms',
+        'p99 ms', 'cpu/wall', 'waiting'))
+    for mode, run in (('threads', run_threads),
+                      ('processes', run_processes)):
+        single = None
+        for count in workers:
+            elapsed, cpu, latencies = run(count, options.renders)
+            latencies.sort()
+            throughput = len(latencies) / elapsed
+            if single is None:
+                single = throughput / count
+
+            waiting = max(1 - cpu / (elapsed * count), 0)
+            print('%-9s %7d %10.0f %7.2fx %8.3f %8.3f %8.3f %8.2f %7.0f%%' % (
+                mode, count, throughput, throughput / single,
+                percentile(latencies, 50) * 1000,
+                percentile(latencies, 90) * 1000,
+                percentile(latencies, 99) * 1000, cpu / elapsed,
+                waiting * 100))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""Shared setup for the benchmarks. The scripts are run from the root of the
+repository, for example::
+
+    python benchmarks/bench_lookup.py
+
+"""
+import os
+import sys
+import timeit
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def configure(**options):
+    """Configure Django like the test suite does (see setup.py)."""
+    sys.path.insert(0, ROOT)
+    sys.path.insert(0, os.path.join(ROOT, 'django_cofingo', 'tests'))
+
+    from django.conf import settings
+    config = dict(
+        DATABASES={
+            'default': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': ':memory:',
+            },
+        },
+        INSTALLED_APPS=[
+            'django.contrib.auth',
+            'django.contrib.contenttypes',
+            'django.contrib.sessions',
+            'django.contrib.sites',
+
+            'django_cofingo',
+            'apps.urls_app',
+            'apps.fullstack_app',
+        ],
+        TEMPLATE_LOADERS=[
+            'django_cofingo.Loader'
+        ],
+        ROOT_URLCONF='apps.urls',
+        DEBUG=False,
+        SITE_ID=1,
+        TEMPLATE_DEBUG=False,
+        TEMPLATE_DIRS=[],
+        SETTINGS_MODULE='apps'
+    )
+    config.update(options)
+    settings.configure(**config)
+
+
+def bench(name, func, number=100, repeat=5):
+    """Print the best time per call of ``func``."""
+    best = min(timeit.repeat(func, number=number, repeat=repeat))
+    print('%-50s %10.1f us' % (name, best / number * 1e6))
@@ -1,6 +1,10 @@
 """Adapter for using Jinja2 with Django."""
+import hashlib
 import imp
 import logging
+import multiprocessing
+import sys
+from itertools import islice
 
 import jinja2
 from django.conf import settings
@@ -9,8 +13,12 @@ from django.template.base import Origin, TemplateDoesNotExist
 from django.template.context import get_standard_processors
 from django.template.loader import BaseLoader
 from django.utils.importlib import import_module
+from jinja2 import meta, nodes
+from jinja2.exceptions import TemplateRuntimeError
+from jinja2.utils import LRUCache, concat, missing
 
-from django_cofingo.utils import django_filter_to_jinja2
+from django_cofingo import budget, optimizer
+from django_cofingo.utils import TemplateCache, django_filter_to_jinja2
 
 
 VERSION = (0, 1, 3)
@@ -18,12 +26,34 @@ __version__ = '.'.join(map(str, VERSION))
 
 log = logging.getLogger('django_cofingo')
 
+# Apps of which the templates are left to Django, see COFINGO_EXCLUDE_APPS.
+DEFAULT_EXCLUDE_APPS = ['debug_toolbar', 'admin']
+
+# Values of these types are compared by value by the import cache.
+CONSTANT_TYPES = frozenset([type(None), bool, int, long, float, str, unicode,
+                            jinja2.Markup])
+
+# Attribute names of a plain dict, used by Environment.getattr().
+DICT_ATTRIBUTES = frozenset(dir(dict))
+
 
 class Environment(jinja2.Environment):
 
     def __init__(self):
         self._libraries = []
 
+        # Language the translations are folded for, only set on the per
+        # language overlays created by _get_language_env().
+        self.fold_language = None
+        self._language_envs = {}
+
+        # Name of a template -> names of the templates which inline it, see
+        # django_cofingo.optimizer.
+        self._dependents = {}
+
+        # See django_cofingo.loaders, set by _get_loaders().
+        self._database_loader = None
+
         loader = jinja2.ChoiceLoader(self._get_loaders())
         options = self._get_options()
 
@@ -62,21 +92,202 @@ class Environment(jinja2.Environment):
             self.install_gettext_translations(translation)
 
     def from_string(self, source, globals=None, template_class=None):
-        return super(Environment, self).from_string(
-            source, globals, template_class or Template)
+        """Compile a template from a string. With
+        COFINGO_FROM_STRING_CACHE_SIZE set the compiled templates are kept
+        in a cache, keyed by the source, template class and globals.
+        """
+        template_class = template_class or Template
+        cache = get_from_string_cache()
+        if cache is None:
+            return super(Environment, self).from_string(
+                source, globals, template_class)
+
+        # The options which change the compiled code are part of the digest.
+        digest = hashlib.sha1(repr((
+            self.fold_language, budget.is_enabled(),
+            bool(getattr(settings, 'COFINGO_TRACING', False)))))
+        digest.update(source.encode('utf-8')
+                      if isinstance(source, unicode) else source)
+        digest = digest.hexdigest()
+        try:
+            key = (id(self), digest, template_class,
+                   tuple(sorted((globals or {}).items())))
+            hash(key)
+        except TypeError:
+            # Unhashable globals
+            return super(Environment, self).from_string(
+                source, globals, template_class)
+
+        template = cache.get(key)
+        if template is None:
+            template = template_class.from_code(
+                self, self._compile_from_string(source, digest),
+                self.make_globals(globals), None)
+            cache.set(key, template)
+        return template
+
+    def _compile_from_string(self, source, digest):
+        """Compile the source, using the bytecode cache if enabled with
+        COFINGO_FROM_STRING_BYTECODE_CACHE.
+        """
+        bcc = self.bytecode_cache
+        if bcc is None or \
+                not getattr(settings, 'COFINGO_FROM_STRING_BYTECODE_CACHE',
+                            False):
+            return self.compile(source)
+        bucket = bcc.get_bucket(self, 'from_string:%s' % digest, None, source)
+        if bucket.code is None:
+            bucket.code = self.compile(source)
+            bcc.set_bucket(bucket)
+        return bucket.code
+
+    def get_template(self, name, parent=None, globals=None):
+        if self._database_loader is not None:
+            self._database_loader.check()
+        if self.fold_language is None and settings.USE_I18N and \
+                getattr(settings, 'COFINGO_I18N_PRECOMPILE', False):
+            from django.utils import translation
+            env = self._get_language_env(translation.get_language())
+            return env.get_template(name, parent, globals)
+        return super(Environment, self).get_template(name, parent, globals)
+
+    def _get_language_env(self, language):
+        """Return the overlay which compiles templates with the translations
+        of the given language folded in, see django_cofingo.i18n.
+        """
+        env = self._language_envs.get(language)
+        if env is None:
+            # The bytecode cache is not aware of the language, so it can't
+            # be shared with the overlay.
+            env = self.overlay(bytecode_cache=None)
+            env.fold_language = language
+            self._language_envs[language] = env
+        return env
+
+    def invalidate_template(self, name):
+        """Remove the template from the template caches (including those of
+        the per language environments), it is loaded again on next use. The
+        templates which inline it are removed as well.
+        """
+        names = set([name])
+        pending = [name]
+        while pending:
+            for dependent in self._dependents.get(pending.pop(), ()):
+                if dependent not in names:
+                    names.add(dependent)
+                    pending.append(dependent)
+
+        for env in [self] + self._language_envs.values():
+            if env.cache is not None:
+                for name in names:
+                    try:
+                        del env.cache[name]
+                    except KeyError:
+                        pass
+
+    def _parse(self, source, name, filename):
+        ast = super(Environment, self)._parse(source, name, filename)
+        if self.fold_language is not None and \
+                not getattr(self, 'newstyle_gettext', False):
+            from django_cofingo.i18n import fold_translations
+            ast = fold_translations(ast, self.fold_language)
+        return ast
+
+    def _generate(self, source, name, filename, defer_init=False):
+        # Optimized and budgeted here rather than in _parse, so that parse()
+        # returns the template as written to meta and lint.
+        line_map = ()
+        if name is not None and self.loader is not None and \
+                optimizer.is_enabled():
+            source = optimizer.optimize(self, source, name)
+            line_map = source.cofingo_line_map
+            if self.optimized:
+                from jinja2.optimizer import optimize
+                source = optimize(source, self)
+        if budget.is_enabled():
+            source = budget.wrap_loops(source)
+        try:
+            code = super(Environment, self)._generate(source, name, filename,
+                                                      defer_init)
+        except jinja2.TemplateSyntaxError, e:
+            optimizer.remap_syntax_error(e, line_map)
+            raise
+        dependencies = getattr(source, 'cofingo_dependencies', None)
+        if dependencies:
+            code += '\n%s = %r\n' % (optimizer.DEPENDENCIES_NAME,
+                                      dependencies)
+        if line_map:
+            code += '%s = %r\n' % (optimizer.LINE_MAP_NAME, line_map)
+        return code
+
+    def handle_exception(self, exc_info=None, rendered=False,
+                         source_hint=None):
+        """Like Jinja's, but the frames of inlined templates are reported at
+        their own name and line, see django_cofingo.optimizer.
+        """
+        if exc_info is None:
+            exc_info = sys.exc_info()
+        traceback = optimizer.make_traceback(exc_info, source_hint)
+        if rendered and self.exception_formatter is not None:
+            return self.exception_formatter(traceback)
+        if self.exception_handler is not None:
+            self.exception_handler(traceback)
+        exc_type, exc_value, tb = traceback.standard_exc_info
+        raise exc_type, exc_value, tb
+
+    def budget_iter(self, iterable):
+        """Called by the loops of templates compiled with a render budget,
+        see django_cofingo.budget.
+        """
+        return budget.budget_iter(iterable)
 
     def getattr(self, obj, attribute):
+        """Same lookup as Jinja2's own implementation (inlined, as this is
+        called for every attribute access), but a missing related object
+        results in an undefined value.
+        """
         try:
-            return super(Environment, self).getattr(obj, attribute)
+            # Fast path for plain dicts: {{ d.key }} can only resolve to the
+            # item, so don't raise an AttributeError first.
+            if type(obj) is dict and attribute not in DICT_ATTRIBUTES:
+                try:
+                    return obj[attribute]
+                except KeyError:
+                    return self.undefined(obj=obj, name=attribute)
+
+            try:
+                return getattr(obj, attribute)
+            except AttributeError:
+                pass
+            try:
+                return obj[attribute]
+            except (TypeError, LookupError, AttributeError):
+                return self.undefined(obj=obj, name=attribute)
         except ObjectDoesNotExist as exc:
             return self.undefined(obj=obj, name=attribute,
                 hint=unicode(exc))
 
-    def getitem(self, obj, attribute):
+    def getitem(self, obj, argument):
+        """Same lookup as Jinja2's own implementation (inlined), but a
+        missing related object results in an undefined value.
+        """
         try:
-            return super(Environment, self).getitem(obj, attribute)
+            try:
+                return obj[argument]
+            except (TypeError, LookupError):
+                if isinstance(argument, basestring):
+                    try:
+                        attr = str(argument)
+                    except Exception:
+                        pass
+                    else:
+                        try:
+                            return getattr(obj, attr)
+                        except AttributeError:
+                            pass
+                return self.undefined(obj=obj, name=argument)
         except ObjectDoesNotExist as exc:
-            return self.undefined(obj=obj, name=attribute,
+            return self.undefined(obj=obj, name=argument,
                 hint=unicode(exc))
 
     def _get_loaders(self):
@@ -86,7 +297,15 @@ class Environment(jinja2.Environment):
         """
         x = ((jinja2.FileSystemLoader, settings.TEMPLATE_DIRS),
              (jinja2.PackageLoader, settings.INSTALLED_APPS))
-        return [loader(p) for loader, places in x for p in places]
+        loaders = [loader(p) for loader, places in x for p in places]
+
+        # Templates in the database override the files.
+        options = getattr(settings, 'COFINGO_DATABASE_TEMPLATES', None)
+        if options:
+            from django_cofingo.loaders import DatabaseLoader
+            self._database_loader = DatabaseLoader(**options)
+            loaders.insert(0, self._database_loader)
+        return loaders
 
     def _get_options(self):
         """Generate a dictionary with the extensions, filters, globals, tests
@@ -190,9 +409,10 @@ class Environment(jinja2.Environment):
                 yield module.library
 
 
-def render_to_string(request, template, context=None):
+def render_to_string(request, template, context=None, block=None):
     """
-    Render a template into a string.
+    Render a template into a string. If a block name is given only that
+    block is rendered, see :meth:`Template.render_block`.
     """
     def get_context():
         c = {} if context is None else context.copy()
@@ -204,19 +424,363 @@ def render_to_string(request, template, context=None):
     if not isinstance(template, jinja2.environment.Template):
         template = env.get_template(template)
 
+    if block is not None:
+        return template.render_block(block, get_context())
     return template.render(get_context())
 
+
+def render_to_response(request, template, context=None, **response_kwargs):
+    """
+    Render a template into an HttpResponse. The output is encoded and
+    written to the response while it is rendered, see
+    :meth:`Template.render_to`.
+    """
+    from django.http import HttpResponse
+
+    c = {} if context is None else context.copy()
+    for processor in get_standard_processors():
+        c.update(processor(request))
+
+    # If it's not a Template, it must be a path to be loaded.
+    if not isinstance(template, jinja2.environment.Template):
+        template = env.get_template(template)
+
+    response = HttpResponse(**response_kwargs)
+    template.render_to(response, c, encoding=response._charset)
+    return response
+
+
+def render_to_strings(request, template, contexts, processes=None,
+                      ordered=True, batch_size=100):
+    """
+    Render a template once for every context in an iterable of contexts,
+    yields the results. The template is looked up and the context
+    processors are run (if a request is given) only once.
+
+    If processes is given the templates are rendered by a pool of that many
+    processes; the template must then be loaded by name, the contexts must
+    be picklable and request must be None (the output of the context
+    processors, such as the lazy CSRF token, can't be sent to other
+    processes). At most ``batch_size`` contexts are read ahead. With
+    ordered=False the results are yielded as soon as they are ready.
+    """
+    if processes and request is not None:
+        raise ValueError('The context processors can not be run for '
+                         'templates rendered in multiple processes, pass '
+                         'None as the request')
+
+    processed = {}
+    if request is not None:
+        for processor in get_standard_processors():
+            processed.update(processor(request))
+
+    def get_context(context):
+        c = {} if context is None else context.copy()
+        c.update(processed)
+        return c
+
+    # If it's not a Template, it must be a path to be loaded.
+    if not isinstance(template, jinja2.environment.Template):
+        template = env.get_template(template)
+
+    if not processes:
+        for context in contexts:
+            yield template.render(get_context(context))
+        return
+
+    if template.name is None:
+        raise ValueError('Only templates loaded by name can be rendered in '
+                         'multiple processes')
+
+    contexts = iter(contexts)
+    pool = multiprocessing.Pool(processes, _init_render_process)
+    try:
+        imap = pool.imap if ordered else pool.imap_unordered
+        while True:
+            batch = [(template.name, get_context(context))
+                     for context in islice(contexts, batch_size)]
+            if not batch:
+                break
+            chunksize = max(len(batch) // (processes * 4), 1)
+            for result in imap(_render_in_process, batch, chunksize):
+                yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+# Database connections inherited from the parent process, kept around so that
+# they are not closed (which would close the connection of the parent).
+_inherited_connections = []
+
+
+def _init_render_process():
+    from django.db import connections
+    for connection in connections.all():
+        if connection.connection is not None:
+            _inherited_connections.append(connection.connection)
+            connection.connection = None
+
+
+def _render_in_process(args):
+    template_name, context = args
+    return env.get_template(template_name).render(context)
+
 # Create the environment
 env = Environment()
 
 
+# The cache of Environment.from_string(), see get_from_string_cache().
+from_string_cache = None
+
+
+def get_from_string_cache():
+    """Return the cache of compiled templates used by from_string(), or None
+    if COFINGO_FROM_STRING_CACHE_SIZE is not set.
+    """
+    global from_string_cache
+    size = getattr(settings, 'COFINGO_FROM_STRING_CACHE_SIZE', None)
+    if not size:
+        return None
+    if from_string_cache is None or from_string_cache.capacity != size:
+        from_string_cache = TemplateCache(size)
+    return from_string_cache
+
+
+def _passes_context(ast):
+    if ast.find(nodes.Include) is not None or \
+            ast.find(nodes.Extends) is not None:
+        return True
+    return any(node.with_context for node in
+               ast.find_all((nodes.Import, nodes.FromImport)))
+
+
 class Template(jinja2.Template):
 
+    # Name of the template this one extends, resolved on first use by
+    # render_block().
+    _parent_name = missing
+
+    # Render function of the top level imports, assignments and macros,
+    # compiled on first use by render_block().
+    _setup_func = missing
+
+    # (name, checksum) pairs of the templates inlined by the optimizer.
+    _dependencies = ()
+    # (name, filename) of the templates whose lines it inlines.
+    _line_map = ()
+
     def render(self, context={}):
         """Render's a template, context can be a Django Context or a
         dictionary.
         """
-        # flatten the Django Context into a single dictionary.
+        return self._render(self._get_context_dict(context), concat)
+
+    def render_to(self, stream, context={}, encoding='utf-8',
+                  buffer_size=8192):
+        """Render the template into a file-like object (anything with a
+        write() method, like an HttpResponse). The output is encoded and
+        written in pieces of about buffer_size characters while it is
+        generated, so the page is never in memory as a single string.
+        """
+        def write(chunks):
+            buf = []
+            size = 0
+            for chunk in chunks:
+                buf.append(chunk)
+                size += len(chunk)
+                if size >= buffer_size:
+                    stream.write(concat(buf).encode(encoding))
+                    buf = []
+                    size = 0
+            if buf:
+                stream.write(concat(buf).encode(encoding))
+        self._render(self._get_context_dict(context), write)
+
+    def _render(self, context_dict, consume, block_name=None):
+        """Render the template, or only the named block, consume is called
+        with the iterator of the chunks of output.
+        """
+        if getattr(settings, 'COFINGO_QUERYSET_WARNING_THRESHOLD', None):
+            from django_cofingo.debug import warn_materialized_querysets
+            with warn_materialized_querysets(self, context_dict):
+                return self._render_accounted(context_dict, consume,
+                                              block_name)
+        return self._render_accounted(context_dict, consume, block_name)
+
+    def _render_accounted(self, context_dict, consume, block_name):
+        if getattr(settings, 'COFINGO_QUERY_ACCOUNTING', False):
+            from django_cofingo.debug import account_queries
+            with account_queries(self):
+                return self._render_budgeted(context_dict, consume,
+                                             block_name)
+        return self._render_budgeted(context_dict, consume, block_name)
+
+    def _render_budgeted(self, context_dict, consume, block_name):
+        limits = budget.get_limits(self.name)
+        try:
+            if block_name is None:
+                chunks = self.root_render_func(self.new_context(context_dict))
+            else:
+                chunks = self._render_block_func(block_name, context_dict)
+            if limits is None or budget.current() is not None:
+                return consume(chunks)
+            with budget.RenderBudget(self.name, limits) as render_budget:
+                return consume(render_budget.iter_output(chunks))
+        except Exception:
+            exc_info = sys.exc_info()
+        return self.environment.handle_exception(exc_info, True)
+
+    def render_block(self, block_name, context={}):
+        """Render a single block of the template, context can be a Django
+        Context or a dictionary.
+
+        The block may be defined in this template or in any of the templates
+        it extends, ``super()`` works as usual. Only the requested block is
+        evaluated, the rest of the page is skipped. The top level imports,
+        assignments and macros of the template and its parents are run
+        first, other code outside of blocks is not executed. Render budgets
+        and query accounting apply as for render().
+        """
+        return self._render(self._get_context_dict(context), concat,
+                            block_name)
+
+    def _render_block_func(self, block_name, context_dict):
+        ctx = self.new_context(context_dict)
+        templates = [self] + list(self._get_parents())
+        for parent in templates[1:]:
+            for name, block in parent.blocks.iteritems():
+                ctx.blocks.setdefault(name, []).append(block)
+        try:
+            block_func = ctx.blocks[block_name][0]
+        except KeyError:
+            raise TemplateRuntimeError(
+                'Block %r is not defined in template %r or its parents'
+                % (block_name, self.name))
+        # In the order render() runs them, the child before its parents
+        for template in templates:
+            setup_func = template._get_setup_func()
+            if setup_func is not None:
+                for event in setup_func(ctx):
+                    pass
+        return block_func(ctx)
+
+    def _get_setup_func(self):
+        """Return the render function of a template made of the top level
+        imports, assignments and macros of this one, or None if it has none.
+        """
+        if self._setup_func is missing:
+            setup_func = None
+            ast = self._get_ast()
+            if ast is not None:
+                body = [node for node in ast.body if isinstance(
+                    node, (nodes.Import, nodes.FromImport, nodes.Assign,
+                           nodes.Macro))]
+                if body:
+                    setup = nodes.Template(body, lineno=1)
+                    setup.set_environment(self.environment)
+                    code = self.environment.compile(setup, self.name,
+                                                    self.filename)
+                    setup_func = jinja2.Template.from_code(
+                        self.environment, code,
+                        self.globals).root_render_func
+            self._setup_func = setup_func
+        return self._setup_func
+
+    def get_source_location(self, code_lineno):
+        """Return the template name, filename and line number of a line of
+        the compiled code. Lines inlined by the optimizer are reported in
+        the template they come from.
+        """
+        return optimizer.source_location(
+            self._line_map, self.name, self.filename,
+            self.get_corresponding_lineno(code_lineno))
+
+    @classmethod
+    def from_code(cls, environment, code, globals, uptodate=None):
+        template = super(Template, cls).from_code(environment, code, globals,
+                                                  uptodate)
+        if template._dependencies:
+            checks = optimizer.dependency_checks(template)
+            if checks is None:
+                # Compiled before an inlined template changed, for example
+                # loaded from the bytecode cache.
+                return cls.from_code(environment,
+                                     optimizer.recompile(template), globals,
+                                     uptodate)
+            optimizer.track_dependencies(template, uptodate, checks)
+        return template
+
+    @classmethod
+    def _from_namespace(cls, environment, namespace, globals):
+        template = super(Template, cls)._from_namespace(
+            environment, namespace, globals)
+        template._dependencies = namespace.get(optimizer.DEPENDENCIES_NAME,
+                                               ())
+        template._line_map = namespace.get(optimizer.LINE_MAP_NAME, ())
+        if getattr(settings, 'COFINGO_TRACING', False):
+            from django_cofingo.tracing import instrument
+            instrument(template, namespace)
+        return template
+
+    def make_module(self, vars=None, shared=False, locals=None):
+        """Used by imports ``with context``. With COFINGO_IMPORT_CACHE_SIZE
+        set the modules are cached, keyed by the values of the variables the
+        template references.
+        """
+        cache_size = getattr(settings, 'COFINGO_IMPORT_CACHE_SIZE', None)
+        if not cache_size or vars is None:
+            return super(Template, self).make_module(vars, shared, locals)
+
+        names = self._get_referenced_names()
+        if names is None:
+            return super(Template, self).make_module(vars, shared, locals)
+
+        module_vars = {}
+        key = []
+        for name in names:
+            value = missing
+            if locals:
+                value = locals.get('l_' + name, missing)
+            if value is missing:
+                value = vars.get(name, missing)
+            if value is missing:
+                continue
+            module_vars[name] = value
+            # Other objects are cached by identity, they are kept alive by
+            # the module so the id can't be reused.
+            if type(value) in CONSTANT_TYPES:
+                key.append((name, type(value), value))
+            else:
+                key.append((name, id(value)))
+        key = tuple(key)
+
+        cache = self.__dict__.get('_module_cache')
+        if cache is None:
+            cache = self._module_cache = LRUCache(cache_size)
+        module = cache.get(key)
+        if module is None:
+            module = super(Template, self).make_module(module_vars)
+            cache[key] = module
+        return module
+
+    def _get_referenced_names(self):
+        """Return the names of the variables which the template gets from
+        the context, or None when the source is not available or the
+        template passes the whole context on (includes, extends and imports
+        with context).
+        """
+        names = self.__dict__.get('_referenced_names', missing)
+        if names is missing:
+            ast = self._get_ast()
+            names = None
+            if ast is not None and not _passes_context(ast):
+                names = sorted(meta.find_undeclared_variables(ast))
+            self._referenced_names = names
+        return names
+
+    def _get_context_dict(self, context):
+        """Flatten the Django Context into a single dictionary."""
         context_dict = {}
         if hasattr(context, 'dicts'):
             for d in context.dicts:
@@ -241,7 +805,46 @@ class Template(jinja2.Template):
         # we need to store the current_app attribute as a key/value pair.
         context_dict['_current_app'] = getattr(context, 'current_app', None)
 
-        return super(Template, self).render(context_dict)
+        # Storage for the {% memo %} tag, scoped to this render.
+        context_dict['_memo'] = {}
+        return context_dict
+
+    def _get_ast(self):
+        """Parse the source of the template again, returns None when the
+        source is not available (for example when created with
+        ``from_string``).
+        """
+        loader = self.environment.loader
+        if self.name is None or loader is None:
+            return None
+        source, filename, uptodate = loader.get_source(
+            self.environment, self.name)
+        return self.environment.parse(source, self.name, filename)
+
+    def _get_parents(self):
+        """Yield the templates this template extends, nearest first. Only
+        templates which extend a constant template name are supported.
+        """
+        template = self
+        while True:
+            if template._parent_name is missing:
+                parent_name = None
+                ast = template._get_ast()
+                node = ast.find(nodes.Extends) if ast is not None else None
+                if node is not None:
+                    if not isinstance(node.template, nodes.Const):
+                        raise TemplateRuntimeError(
+                            'Template %r extends a dynamic template name, '
+                            'its blocks can not be rendered separately'
+                            % template.name)
+                    parent_name = node.template.value
+                template._parent_name = parent_name
+
+            if template._parent_name is None:
+                return
+            template = template.environment.get_template(
+                template._parent_name, template.name)
+            yield template
 
 
 class Loader(BaseLoader):
@@ -250,10 +853,8 @@ class Loader(BaseLoader):
 
     def load_template(self, template_name, template_dirs=None):
         if hasattr(template_name, 'rsplit'):
-            exclude_apps = getattr(settings, 'COFINGO_EXCLUDE_APPS', [
-                'debug_toolbar',
-                'admin'
-            ])
+            exclude_apps = getattr(settings, 'COFINGO_EXCLUDE_APPS',
+                                   DEFAULT_EXCLUDE_APPS)
 
             app = template_name.rsplit('/')[0]
             if app in exclude_apps:
@@ -0,0 +1,166 @@
+"""Limits on the resources a single render may use.
+
+A budget limits the wall-clock time of a render in seconds, the size of the
+output in characters and the total number of loop iterations. Set a default
+budget and budgets per template name in your settings::
+
+    COFINGO_RENDER_BUDGET = {'time': 5, 'output': 10 * 1024 * 1024}
+    COFINGO_TEMPLATE_BUDGETS = {
+        'sitemap.xml': {'time': 30, 'iterations': 500000},
+    }
+
+A render which exceeds its budget is aborted with a
+:exc:`RenderBudgetExceeded` exception, and the :data:`budget_exceeded`
+signal is sent so it can be counted. Templates included by (or rendered
+during) a render count towards the budget of the outermost render.
+
+Loops are only counted in templates compiled while a budget is configured.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.dispatch import Signal
+from jinja2 import nodes
+from jinja2.visitor import NodeTransformer
+
+log = logging.getLogger('django_cofingo')
+
+# Sent with the template name, the kind of limit ('time', 'output' or
+# 'iterations'), the limit and the value which exceeded it.
+budget_exceeded = Signal(providing_args=['template_name', 'kind', 'limit',
+                                         'value'])
+
+# The time is checked once every this many loop iterations.
+TIME_CHECK_INTERVAL = 100
+
+_state = threading.local()
+
+
+class RenderBudgetExceeded(Exception):
+
+    def __init__(self, template_name, kind, limit, value):
+        self.template_name = template_name
+        self.kind = kind
+        self.limit = limit
+        self.value = value
+        super(RenderBudgetExceeded, self).__init__(
+            'Rendering %r exceeded the %s budget: %s > %s'
+            % (template_name, kind, value, limit))
+
+
+def is_enabled():
+    return bool(getattr(settings, 'COFINGO_RENDER_BUDGET', None) or
+                getattr(settings, 'COFINGO_TEMPLATE_BUDGETS', None))
+
+
+def get_limits(template_name):
+    """Return the limits for the given template, or None."""
+    limits = getattr(settings, 'COFINGO_RENDER_BUDGET', None)
+    templates = getattr(settings, 'COFINGO_TEMPLATE_BUDGETS', None)
+    if templates and template_name in templates:
+        limits = dict(limits or {}, **templates[template_name])
+    return limits or None
+
+
+def current():
+    """Return the budget of the render in progress in this thread."""
+    return getattr(_state, 'budget', None)
+
+
+class RenderBudget(object):
+
+    def __init__(self, template_name, limits):
+        self.template_name = template_name
+        self.time = limits.get('time')
+        self.output = limits.get('output')
+        self.iterations = limits.get('iterations')
+
+        self.start = time.time()
+        self.deadline = self.start + self.time if self.time else None
+        self.output_size = 0
+        self.iteration_count = 0
+
+    def __enter__(self):
+        _state.budget = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        _state.budget = None
+
+    def exceeded(self, kind, limit, value):
+        budget_exceeded.send(sender=self.__class__,
+                             template_name=self.template_name,
+                             kind=kind, limit=limit, value=value)
+        log.warning('Rendering %s exceeded the %s budget: %s > %s',
+                    self.template_name, kind, value, limit)
+        raise RenderBudgetExceeded(self.template_name, kind, limit, value)
+
+    def check_time(self):
+        if self.deadline is not None:
+            now = time.time()
+            if now > self.deadline:
+                self.exceeded('time', self.time,
+                              round(now - self.start, 3))
+
+    def iter_output(self, chunks):
+        """Yield the chunks of output, checking the time and output size
+        after each chunk.
+        """
+        for chunk in chunks:
+            if self.output is not None:
+                self.output_size += len(chunk)
+                if self.output_size > self.output:
+                    self.exceeded('output', self.output, self.output_size)
+            self.check_time()
+            yield chunk
+
+
+class BudgetedIterable(object):
+    """Counts the iterations of a loop, keeps the length of the iterable
+    available for ``loop.length``.
+    """
+
+    def __init__(self, iterable, budget):
+        self.iterable = iterable
+        self.budget = budget
+
+    def __len__(self):
+        return len(self.iterable)
+
+    def __iter__(self):
+        budget = self.budget
+        for item in self.iterable:
+            budget.iteration_count += 1
+            if budget.iterations is not None and \
+                    budget.iteration_count > budget.iterations:
+                budget.exceeded('iterations', budget.iterations,
+                                budget.iteration_count)
+            if budget.iteration_count % TIME_CHECK_INTERVAL == 0:
+                budget.check_time()
+            yield item
+
+
+def budget_iter(iterable):
+    """Count the iterations of a loop towards the budget of the render."""
+    budget = current()
+    if budget is None or (budget.iterations is None and budget.time is None):
+        return iterable
+    return BudgetedIterable(iterable, budget)
+
+
+class LoopTransformer(NodeTransformer):
+    """Wraps the iterables of all for loops with budget_iter()."""
+
+    def visit_For(self, node):
+        node = self.generic_visit(node)
+        node.iter = nodes.Call(nodes.EnvironmentAttribute('budget_iter'),
+                               [node.iter], [], None, None,
+                               lineno=node.iter.lineno)
+        node.iter.set_environment(node.environment)
+        return node
+
+
+def wrap_loops(ast):
+    return LoopTransformer().visit(ast)
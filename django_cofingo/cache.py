@@ -0,0 +1,220 @@
+"""Invalidation of ``{% cache %}`` fragments.
+
+Fragments can be tied to tags, a tag is a string, a model instance or a
+model class::
+
+    {% cache 86400 "post" post.pk tags=[post, "frontpage"] %}
+        ...
+    {% endcache %}
+
+Every tag has a version number stored in the cache, which is part of the key
+of the fragment. Invalidating a tag increments its version, so the
+fragments which depend on it are rendered again (the old entries simply
+expire). Tags can be invalidated by hand with :func:`invalidate`, or when
+model instances are saved or deleted::
+
+    from django_cofingo import cache
+
+    cache.register(Post)
+
+This invalidates the tag of the saved instance and the tag of its model.
+
+Large fragments are compressed with zlib before they are stored when
+``COFINGO_CACHE_COMPRESS_THRESHOLD`` is set to a size in bytes, see
+:data:`compression_stats` for the bytes saved and the time spent.
+
+Fragments are stored in the cache named by ``COFINGO_FRAGMENT_CACHE``, for
+example a :class:`django_cofingo.shm.SharedMemoryCache` shared by the
+processes of a host, or else in the default cache.
+"""
+import threading
+import time
+import zlib
+
+from django.conf import settings
+from django.db.models import Model
+from django.db.models.signals import post_delete, post_save
+from django.utils.encoding import smart_str
+from django.utils.hashcompat import md5_constructor
+from jinja2 import Markup
+
+# Compressed fragments start with this header, followed by the format version
+# and a flag which tells if the fragment is markup or plain text. Fragments
+# with a different version are treated as cache misses.
+COMPRESSED_HEADER = 'cofingo.z'
+COMPRESSED_VERSION = '1'
+
+
+def get_tag(obj):
+    """Return the tag for the given string, model instance or model."""
+    if isinstance(obj, basestring):
+        return obj
+    if isinstance(obj, Model):
+        return u'%s:%s' % (get_tag(obj.__class__), obj.pk)
+    if isinstance(obj, type) and issubclass(obj, Model):
+        opts = obj._meta
+        return u'%s.%s' % (opts.app_label, opts.object_name.lower())
+    raise TypeError('Invalid cache tag: %r' % obj)
+
+
+def _get_version_key(tag):
+    tag_md5 = md5_constructor(smart_str(get_tag(tag)))
+    return 'template.cache.tag.%s' % tag_md5.hexdigest()
+
+
+def _new_version():
+    # Based on the current time, so that a version which was evicted from
+    # the cache is never reused.
+    return int(time.time() * 1000000)
+
+
+def _get_timeout():
+    return getattr(settings, 'COFINGO_CACHE_TAG_TIMEOUT', 60 * 60 * 24 * 30)
+
+
+def get_versions(tags):
+    """Return the current versions of the given tags."""
+    from django.core.cache import cache   # delay depending in settings
+
+    keys = [_get_version_key(tag) for tag in tags]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            version = _new_version()
+            if not cache.add(key, version, _get_timeout()):
+                # Another process was first
+                version = cache.get(key, version)
+            versions[key] = version
+    return [versions[key] for key in keys]
+
+
+def invalidate(*tags):
+    """Invalidate all fragments which depend on one of the given tags."""
+    from django.core.cache import cache
+
+    for tag in tags:
+        key = _get_version_key(tag)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _new_version(), _get_timeout())
+
+
+def _invalidate_instance(sender, instance, **kwargs):
+    invalidate(instance, sender)
+
+
+def register(*models):
+    """Invalidate the tags of instances of the given models, and the tag of
+    the model itself, whenever an instance is saved or deleted.
+    """
+    for model in models:
+        dispatch_uid = 'django_cofingo.cache.%s' % get_tag(model)
+        post_save.connect(_invalidate_instance, sender=model,
+                          dispatch_uid=dispatch_uid)
+        post_delete.connect(_invalidate_instance, sender=model,
+                            dispatch_uid=dispatch_uid)
+
+
+# Alias -> cache backend, see get_fragment_cache().
+_fragment_caches = {}
+
+
+def get_fragment_cache():
+    """Return the cache the {% cache %} tag stores fragments in, the cache
+    named by COFINGO_FRAGMENT_CACHE or else the default cache. The versions
+    of the tags are always kept in the default cache.
+    """
+    from django.core.cache import cache, get_cache
+
+    alias = getattr(settings, 'COFINGO_FRAGMENT_CACHE', None)
+    if alias is None:
+        return cache
+    fragment_cache = _fragment_caches.get(alias)
+    if fragment_cache is None:
+        fragment_cache = _fragment_caches[alias] = get_cache(alias)
+    return fragment_cache
+
+
+class CompressionStats(object):
+    """Counters of the compressed fragments, for all threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.compressed = 0
+        self.decompressed = 0
+        self.original_bytes = 0
+        self.compressed_bytes = 0
+        self.compress_time = 0.0
+        self.decompress_time = 0.0
+
+    @property
+    def bytes_saved(self):
+        return self.original_bytes - self.compressed_bytes
+
+    def __repr__(self):
+        return ('<CompressionStats compressed=%d decompressed=%d '
+                'bytes_saved=%d compress_time=%.3fs decompress_time=%.3fs>'
+                % (self.compressed, self.decompressed, self.bytes_saved,
+                   self.compress_time, self.decompress_time))
+
+
+compression_stats = CompressionStats()
+
+
+def compress_fragment(value):
+    """Return the value to store in the cache for a rendered fragment, the
+    fragment is compressed if it is at least COFINGO_CACHE_COMPRESS_THRESHOLD
+    bytes and compression makes it smaller.
+    """
+    threshold = getattr(settings, 'COFINGO_CACHE_COMPRESS_THRESHOLD', None)
+    # A character takes at most 4 bytes, skip encoding small fragments.
+    if threshold is None or len(value) < threshold / 4:
+        return value
+
+    start = time.time()
+    data = value.encode('utf-8')
+    if len(data) < threshold:
+        return value
+    compressed = zlib.compress(data, 1)
+    duration = time.time() - start
+
+    with compression_stats._lock:
+        compression_stats.compress_time += duration
+        if len(compressed) < len(data):
+            compression_stats.compressed += 1
+            compression_stats.original_bytes += len(data)
+            compression_stats.compressed_bytes += len(compressed)
+    if len(compressed) >= len(data):
+        return value
+
+    flag = 'm' if isinstance(value, Markup) else 'u'
+    return COMPRESSED_HEADER + COMPRESSED_VERSION + flag + compressed
+
+
+def decompress_fragment(value):
+    """Reverse of :func:`compress_fragment`, returns None for a value in
+    an unknown format.
+    """
+    if not isinstance(value, str) or not value.startswith(COMPRESSED_HEADER):
+        return value
+
+    offset = len(COMPRESSED_HEADER)
+    if value[offset:offset + 1] != COMPRESSED_VERSION:
+        return None
+    flag = value[offset + 1:offset + 2]
+
+    start = time.time()
+    try:
+        rv = zlib.decompress(value[offset + 2:]).decode('utf-8')
+    except (zlib.error, UnicodeDecodeError):
+        return None
+    duration = time.time() - start
+
+    with compression_stats._lock:
+        compression_stats.decompressed += 1
+        compression_stats.decompress_time += duration
+    return Markup(rv) if flag == 'm' else rv
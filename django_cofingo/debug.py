@@ -0,0 +1,215 @@
+"""Instrumentation to find the database queries caused by templates.
+
+Lazy querysets and related objects are often evaluated while rendering, this
+module records every query executed during a render together with the
+template name and line number which triggered it::
+
+    from django_cofingo.debug import record_queries
+
+    with record_queries() as report:
+        template.render(context)
+    print report
+
+Set ``COFINGO_QUERY_ACCOUNTING = True`` to record the queries of every
+render. A warning with the report is then logged when a render executes
+``COFINGO_QUERY_WARNING_THRESHOLD`` or more queries.
+
+Set ``COFINGO_QUERYSET_WARNING_THRESHOLD`` to log a warning when a queryset
+of the context with that many rows or more is loaded in memory by a render,
+use the ``chunked`` filter to loop over those.
+"""
+import logging
+import sys
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+
+log = logging.getLogger('django_cofingo')
+
+
+def frame_location(frame):
+    """Return the template name and line number of the given frame, or None
+    if the frame is not compiled template code.
+    """
+    template = frame.f_globals.get('__jinja_template__')
+    if template is None:
+        return None
+    if hasattr(template, 'get_source_location'):
+        name, filename, lineno = template.get_source_location(frame.f_lineno)
+        return (name, lineno)
+    return (template.name, template.get_corresponding_lineno(frame.f_lineno))
+
+
+def template_location(frame):
+    """Return the template name and line number of the innermost compiled
+    template in the stack of the given frame, or None if the frame is not
+    called from a template.
+    """
+    while frame is not None:
+        location = frame_location(frame)
+        if location is not None:
+            return location
+        frame = frame.f_back
+    return None
+
+
+class QueryReport(object):
+    """The queries recorded by :func:`record_queries`, grouped by template
+    name and line number.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.lines = {}
+        # Queries of the {% parallel %} tag are added from worker threads.
+        self._lock = threading.Lock()
+
+    def add(self, query, location):
+        duration = float(query.get('time') or 0)
+        with self._lock:
+            self.count += 1
+            self.time += duration
+
+            stats = self.lines.setdefault(location, [0, 0.0])
+            stats[0] += 1
+            stats[1] += duration
+
+    def by_template(self):
+        """Return the number of queries and their time per template."""
+        templates = {}
+        for location, (count, duration) in self.lines.iteritems():
+            name = location[0] if location else None
+            stats = templates.setdefault(name, [0, 0.0])
+            stats[0] += count
+            stats[1] += duration
+        return templates
+
+    def __unicode__(self):
+        lines = [u'%d queries in %.3fs' % (self.count, self.time)]
+        for location, (count, duration) in sorted(
+                self.lines.iteritems(), key=lambda item: -item[1][0]):
+            if location is None:
+                location = u'(outside of templates)'
+            else:
+                location = u'%s:%d' % (location[0] or u'<string>', location[1])
+            lines.append(u'  %5d %8.3fs  %s' % (count, duration, location))
+        return u'\n'.join(lines)
+
+    def __str__(self):
+        return unicode(self).encode('utf-8')
+
+
+class RecordingQueryList(list):
+    """Replaces ``connection.queries`` while recording, Django appends the
+    executed queries right after running them, so the stack still shows
+    which template triggered the query.
+    """
+
+    def __init__(self, queries, reports):
+        super(RecordingQueryList, self).__init__(queries)
+        self.reports = reports
+
+    def append(self, query):
+        super(RecordingQueryList, self).append(query)
+        location = template_location(sys._getframe(1))
+        for report in self.reports:
+            report.add(query, location)
+
+
+@contextmanager
+def record_queries():
+    """Record the queries executed on all database connections of the
+    current thread, yields a :class:`QueryReport`.
+    """
+    report = QueryReport()
+    with record_into([report]):
+        yield report
+
+
+def active_reports():
+    """Return the reports the queries of the current thread are recorded
+    in.
+    """
+    from django.db import connections
+
+    for connection in connections.all():
+        if isinstance(connection.queries, RecordingQueryList):
+            return list(connection.queries.reports)
+    return []
+
+
+@contextmanager
+def record_into(reports):
+    """Record the queries executed on all database connections of the
+    current thread in the given reports, for example those of
+    :func:`active_reports` in another thread.
+    """
+    from django.db import connections
+
+    saved = []
+    for connection in connections.all():
+        queries = connection.queries
+        connection_reports = list(reports)
+        if isinstance(queries, RecordingQueryList):
+            connection_reports = queries.reports + connection_reports
+        saved.append((connection, queries, connection.use_debug_cursor))
+        connection.queries = RecordingQueryList(queries, connection_reports)
+        connection.use_debug_cursor = True
+    try:
+        yield
+    finally:
+        for connection, queries, use_debug_cursor in saved:
+            # Keep the queries if Django would have recorded them anyway.
+            if isinstance(queries, RecordingQueryList) or use_debug_cursor or \
+                    (use_debug_cursor is None and settings.DEBUG):
+                queries[:] = connection.queries
+            connection.queries = queries
+            connection.use_debug_cursor = use_debug_cursor
+
+
+@contextmanager
+def account_queries(template):
+    """Record the queries of a render of the given template, used by
+    ``Template.render`` when ``COFINGO_QUERY_ACCOUNTING`` is enabled.
+    Nested renders are accounted to the outermost render.
+    """
+    from django.db import connections
+
+    if any(isinstance(connection.queries, RecordingQueryList)
+           for connection in connections.all()):
+        yield
+        return
+
+    with record_queries() as report:
+        yield
+
+    threshold = getattr(settings, 'COFINGO_QUERY_WARNING_THRESHOLD', None)
+    if threshold is not None and report.count >= threshold:
+        log.warning('Rendering %s executed %d queries\n%s',
+                    template.name, report.count, report)
+    else:
+        log.debug('Rendering %s executed %d queries\n%s',
+                  template.name, report.count, report)
+
+
+@contextmanager
+def warn_materialized_querysets(template, context):
+    """Warn about the large querysets in the context which are evaluated
+    during the render of the given template, used by ``Template.render``
+    when ``COFINGO_QUERYSET_WARNING_THRESHOLD`` is set.
+    """
+    from django.db.models.query import QuerySet
+
+    querysets = [(name, value) for name, value in context.iteritems()
+                 if isinstance(value, QuerySet) and value._result_cache is None]
+    yield
+
+    threshold = settings.COFINGO_QUERYSET_WARNING_THRESHOLD
+    for name, queryset in querysets:
+        if queryset._result_cache is not None and \
+                len(queryset._result_cache) >= threshold:
+            log.warning('Rendering %s loaded %d rows of queryset %r in '
+                        'memory, consider the chunked filter',
+                        template.name, len(queryset._result_cache), name)
@@ -1,10 +1,28 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+
 from django.conf import settings
 from jinja2 import nodes
 from jinja2.ext import Extension
-from jinja2.exceptions import TemplateSyntaxError
-from jinja2 import Markup
+from jinja2.exceptions import TemplateSyntaxError, TemplateNotFound
+from jinja2 import escape, Markup
+from jinja2.runtime import Undefined
+from jinja2.utils import concat
+
+from django_cofingo import tracing
+from django_cofingo.library import Library, _make_key
+
+log = logging.getLogger('django_cofingo')
+
 
-from django_cofingo.library import Library
+@contextmanager
+def _nullcontext():
+    yield
 
 
 class LoadExtension(Extension):
@@ -122,6 +140,13 @@ class URLExtension(Extension):
 
     @classmethod
     def _reverse(self, viewname, args, kwargs, current_app=None, fail=True):
+        with tracing.span('url', 'url', view=viewname):
+            return self._reverse_url(viewname, args, kwargs, current_app,
+                                     fail)
+
+    @classmethod
+    def _reverse_url(self, viewname, args, kwargs, current_app=None,
+                     fail=True):
         from django.core.urlresolvers import reverse, NoReverseMatch
 
         # Try to look up the URL twice: once given the view name,
@@ -171,10 +196,13 @@ class CacheExtension(Extension):
 
     General Syntax:
 
-        {% cache [expire_time] [fragment_name] [var1] [var2] .. %}
+        {% cache [expire_time] [fragment_name] [var1] [var2] .. [tags=..] %}
             .. some expensive processing ..
         {% endcache %}
 
+    The optional tags (a list of strings, model instances or models) tie the
+    fragment to tags which can be invalidated, see ``django_cofingo.cache``.
+
     Available by default (does not need to be loaded).
 
     Partly based on the ``FragmentCacheExtension`` from the Jinja2 docs.
@@ -207,7 +235,13 @@ class CacheExtension(Extension):
         expire_time = parser.parse_expression()
         fragment_name = parser.parse_expression()
         vary_on = []
+        tags = nodes.Const(None)
         while not parser.stream.current.test('block_end'):
+            if parser.stream.current.test('name:tags') and \
+                    parser.stream.look().test('assign'):
+                parser.stream.skip(2)
+                tags = parser.parse_expression()
+                break
             vary_on.append(parser.parse_expression())
 
         body = parser.parse_statements(['name:endcache'], drop_needle=True)
@@ -215,13 +249,16 @@ class CacheExtension(Extension):
         return nodes.CallBlock(
             self.call_method('_cache_support',
                              [expire_time, fragment_name,
-                              nodes.List(vary_on), nodes.Const(lineno)]),
+                              nodes.List(vary_on), tags, nodes.Const(lineno)]),
             [], [], body).set_lineno(lineno)
 
-    def _cache_support(self, expire_time, fragm_name, vary_on, lineno, caller):
-        from django.core.cache import cache   # delay depending in settings
+    def _cache_support(self, expire_time, fragm_name, vary_on, tags, lineno,
+                       caller):
         from django.utils.http import urlquote
         from django.utils.hashcompat import md5_constructor
+        from django_cofingo.cache import (
+            compress_fragment, decompress_fragment, get_fragment_cache,
+            get_versions)
 
         try:
             expire_time = int(expire_time)
@@ -229,16 +266,288 @@ class CacheExtension(Extension):
             raise TemplateSyntaxError('"%s" tag got a non-integer timeout '
                 'value: %r' % (list(self.tags)[0], expire_time), lineno)
 
+        if tags:
+            if not isinstance(tags, (list, tuple)):
+                tags = [tags]
+            vary_on = list(vary_on) + get_versions(tags)
+
         args_string = u':'.join([urlquote(v) for v in vary_on])
         args_md5 = md5_constructor(args_string)
         cache_key = 'template.cache.%s.%s' % (fragm_name, args_md5.hexdigest())
-        value = cache.get(cache_key)
+        cache = get_fragment_cache()
+        with tracing.span('cache %s' % fragm_name, 'cache') as span:
+            value = cache.get(cache_key)
+            if value is not None:
+                value = decompress_fragment(value)
+            span.set('hit', value is not None)
+            if value is None:
+                value = caller()
+                cache.set(cache_key, compress_fragment(value), expire_time)
+        return value
+
+
+class MemoExtension(Extension):
+    """Remembers the output of its body for the duration of a single render
+    and reuses it when the tag is evaluated again with equal arguments.
+    This is useful for includes and macro calls which are repeated with the
+    same arguments within a loop::
+
+        {% for product in products %}
+            {% memo product.price product.currency %}
+                {{ shop.price_widget(product.price, product.currency) }}
+            {% endmemo %}
+        {% endfor %}
+
+    General Syntax:
+
+        {% memo [var1] [var2] .. %}
+            .. some expensive processing ..
+        {% endmemo %}
+
+    Unlike the cache tag nothing is stored outside of the current render
+    and no fragment name is needed; the position of the tag in the template
+    identifies the fragment. As with the cache tag it is your responsibility
+    to pass every value the body depends on. Arguments which can not be
+    hashed disable the memo for that call.
+
+    Available by default (does not need to be loaded). The memo is only
+    active for templates rendered through ``django_cofingo.Template``.
+    """
+
+    tags = set(['memo'])
+
+    def parse(self, parser):
+        lineno = parser.stream.next().lineno
+
+        vary_on = []
+        while not parser.stream.current.test('block_end'):
+            vary_on.append(parser.parse_expression())
+
+        body = parser.parse_statements(['name:endmemo'], drop_needle=True)
+
+        # The identifier tells apart the tags of one line. Templates created
+        # with from_string have no name, the digest of the body keeps their
+        # fragments apart.
+        fragm_key = (parser.name, lineno, parser.free_identifier().name)
+        if parser.name is None:
+            from django.utils.hashcompat import md5_constructor
+            fragm_key += (md5_constructor(repr(body)).hexdigest(),)
+        return nodes.CallBlock(
+            self.call_method('_memo_support',
+                             [nodes.Name('_memo', 'load'),
+                              nodes.Const(fragm_key),
+                              nodes.List(vary_on)]),
+            [], [], body).set_lineno(lineno)
+
+    def _memo_support(self, memo, fragm_key, vary_on, caller):
+        if isinstance(memo, Undefined):
+            return caller()
+
+        # The types are part of the key, Markup('<b>') == u'<b>'
+        key = (fragm_key, _make_key(vary_on, None))
+        try:
+            value = memo.get(key)
+        except TypeError:  # unhashable argument
+            return caller()
         if value is None:
-            value = caller()
-            cache.set(cache_key, value, expire_time)
+            value = memo[key] = caller()
         return value
 
 
+class ParallelExtension(Extension):
+    """Renders the includes within the tag concurrently in a thread pool and
+    outputs them in the original order. Use this for independent parts of
+    a page which each spend most of their time waiting on I/O::
+
+        {% parallel 2 "<p>Not available</p>"|safe %}
+            {% include "shop/recommendations.html" %}
+            {% include "shop/reviews.html" %}
+        {% endparallel %}
+
+    General Syntax:
+
+        {% parallel [timeout] [fallback] %}
+            {% include ... %}
+            ..
+        {% endparallel %}
+
+    The body may only contain includes. An include which is not done
+    within ``timeout`` seconds of the start of the tag is replaced with the
+    fallback (an empty string by default); the thread itself can not be
+    interrupted, so it keeps its worker busy until it finishes. Exceptions
+    raised while rendering an include are re-raised.
+
+    The included templates see the variables of the template context, but
+    not the variables of an enclosing for-loop or with-block. The active
+    translation, render budget, query accounting and tracer of the render
+    are used by the workers as well. Every worker thread uses its own
+    database connection, which is closed when the include is done; it does
+    not see the uncommitted changes of the transaction of the request.
+
+    The size of the thread pool is set with ``COFINGO_PARALLEL_WORKERS``
+    (4 by default). Nested parallel tags are rendered sequentially.
+
+    Available by default (does not need to be loaded).
+    """
+
+    tags = set(['parallel'])
+
+    _pool = None
+    # Process the pool was created in, a forked process needs its own.
+    _pool_pid = None
+    _pool_lock = threading.Lock()
+    _state = threading.local()
+
+    def parse(self, parser):
+        lineno = parser.stream.next().lineno
+
+        timeout = nodes.Const(None)
+        fallback = nodes.Const(u'')
+        if not parser.stream.current.test('block_end'):
+            timeout = parser.parse_expression()
+        if not parser.stream.current.test('block_end'):
+            fallback = parser.parse_expression()
+
+        body = parser.parse_statements(['name:endparallel'], drop_needle=True)
+
+        # Collect the includes, static data between them is kept so that
+        # the output is exactly the same as without the tag.
+        parts = []
+        for node in body:
+            if isinstance(node, nodes.Include):
+                parts.append(nodes.Tuple([
+                    node.template,
+                    nodes.Const(node.with_context),
+                    nodes.Const(node.ignore_missing)], 'load'))
+            elif isinstance(node, nodes.Output) and all(
+                    isinstance(child, nodes.TemplateData)
+                    for child in node.nodes):
+                parts.extend(nodes.Const(child.data) for child in node.nodes)
+            else:
+                raise TemplateSyntaxError(
+                    '"parallel" tag may only contain include tags',
+                    node.lineno, parser.name, parser.filename)
+
+        return nodes.Output([
+            self.call_method('_render_parallel', [
+                nodes.ContextReference(), nodes.List(parts),
+                timeout, fallback, nodes.Const(lineno)]),
+        ]).set_lineno(lineno)
+
+    @classmethod
+    def _get_pool(cls):
+        pid = os.getpid()
+        if cls._pool is None or cls._pool_pid != pid:
+            with cls._pool_lock:
+                if cls._pool is None or cls._pool_pid != pid:
+                    workers = getattr(settings, 'COFINGO_PARALLEL_WORKERS', 4)
+                    cls._pool = ThreadPool(workers)
+                    cls._pool_pid = pid
+        return cls._pool
+
+    @classmethod
+    def _render_include(cls, template, vars, with_context, state=None):
+        in_worker = getattr(cls._state, 'in_worker', False)
+        cls._state.in_worker = True
+        try:
+            if state is None:
+                return cls._render_template(template, vars, with_context)
+            with cls._request_state(state):
+                return cls._render_template(template, vars, with_context)
+        finally:
+            cls._state.in_worker = in_worker
+
+    @staticmethod
+    def _render_template(template, vars, with_context):
+        if with_context:
+            return concat(template.root_render_func(
+                template.new_context(vars, True)))
+        return concat(template.module._body_stream)
+
+    @staticmethod
+    def _get_request_state():
+        """Return the thread local state of the render which the workers
+        take over.
+        """
+        from django.utils import translation
+        from django_cofingo import budget, debug
+        return (translation.get_language(), budget.current(),
+                tracing.current(), debug.active_reports())
+
+    @staticmethod
+    @contextmanager
+    def _request_state(state):
+        from django.db import connections
+        from django.utils import translation
+        from django_cofingo.debug import record_into
+
+        language, render_budget, tracer, reports = state
+        translation.activate(language)
+        try:
+            with tracing.use_tracer(tracer):
+                with record_into(reports) if reports else _nullcontext():
+                    with render_budget or _nullcontext():
+                        yield
+        finally:
+            translation.deactivate()
+            for connection in connections.all():
+                connection.close()
+
+    def _render_parallel(self, context, parts, timeout, fallback, lineno):
+        if timeout is not None:
+            try:
+                timeout = float(timeout)
+            except (ValueError, TypeError):
+                raise TemplateSyntaxError('"%s" tag got a non-numeric '
+                    'timeout value: %r' % (list(self.tags)[0], timeout),
+                    lineno)
+        if self.environment.autoescape:
+            fallback = escape(fallback)
+
+        vars = context.get_all()
+        sequential = getattr(self._state, 'in_worker', False)
+        if not sequential:
+            state = self._get_request_state()
+
+        # Look up the templates first, so that a missing template is reported
+        # before any work is started.
+        results = []
+        for part in parts:
+            if isinstance(part, tuple):
+                template, with_context, ignore_missing = part
+                try:
+                    template = self.environment.get_or_select_template(
+                        template, context.name)
+                except TemplateNotFound:
+                    if not ignore_missing:
+                        raise
+                    part = u''
+                else:
+                    args = (template, vars, with_context)
+                    if sequential:
+                        part = self._render_include(*args)
+                    else:
+                        part = self._get_pool().apply_async(
+                            self._render_include, args + (state,))
+            results.append(part)
+
+        deadline = time.time() + timeout if timeout is not None else None
+        output = []
+        for result in results:
+            if not isinstance(result, basestring):
+                try:
+                    if deadline is None:
+                        result = result.get()
+                    else:
+                        result = result.get(max(deadline - time.time(), 0))
+                except TimeoutError:
+                    log.warning('Include in "parallel" tag of %s:%s timed '
+                                'out', context.name, lineno)
+                    result = fallback
+            output.append(result)
+        return Markup(concat(output))
+
+
 class SpacelessExtension(Extension):
     """Removes whitespace between HTML tags, including tab and
     newline characters.
@@ -288,6 +597,8 @@ class CsrfTokenExtension(Extension):
 load = LoadExtension
 url = URLExtension
 cache = CacheExtension
+memo = MemoExtension
+parallel = ParallelExtension
 spaceless = SpacelessExtension
 csrf_token = CsrfTokenExtension
 
@@ -296,5 +607,7 @@ library = Library()
 library.extension(load)
 library.extension(url)
 library.extension(cache)
+library.extension(memo)
+library.extension(parallel)
 library.extension(spaceless)
 library.extension(csrf_token)
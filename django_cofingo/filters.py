@@ -6,16 +6,33 @@ filters. Those can be overridden here.
 
 TODO: Most of the filters in here need to be updated for autoescaping.
 """
+import re
+
+from django.template import defaultfilters
+from django.utils.encoding import force_unicode
+from django.utils.html import escape
 from django.utils.translation import ugettext, ungettext
 from jinja2 import filters
-from jinja2 import Markup
+from jinja2 import environmentfilter, evalcontextfilter, Markup
 from jinja2.runtime import Undefined
+from jinja2.utils import urlize as urlize_text
 
 from django_cofingo.library import Library
-from django_cofingo.utils import template_localtime
+from django_cofingo.utils import (
+    ChunkedQuerySet, django_filter_to_jinja2, template_localtime)
 
 library = Library()
 
+# Words like Django's HTML truncation matches them, but including the words
+# within tags and entities.
+re_words = re.compile(r'\w[\w-]*', re.U)
+
+# Same as the pattern used by Jinja2's urlize() to split words.
+re_whitespace = re.compile(r'(\s+)')
+
+# Same as the pattern Django's linebreaks() splits paragraphs on.
+re_paragraphs = re.compile(u'\n{2,}')
+
 
 @library.filter
 def timesince(value, *arg):
@@ -71,8 +88,84 @@ def truncatewords(value, length):
 
 @library.filter
 def truncatewords_html(value, length):
+    """Django's truncatewords_html, with a fast path for values which don't
+    have to be truncated at all.
+    """
     from django.utils.text import truncate_html_words
-    return truncate_html_words(value, int(length))
+    length = int(length)
+    if length > 0:
+        # Every word Django counts is also matched here (tags and entities
+        # can only add matches), so if there are not more matches than
+        # allowed words the value is returned unchanged.
+        value = force_unicode(value)
+        count = 0
+        for count, match in enumerate(re_words.finditer(value), 1):
+            if count > length:
+                break
+        if count <= length:
+            return value
+    return truncate_html_words(value, length)
+
+
+_django_linebreaks = django_filter_to_jinja2(
+    defaultfilters.register.filters['linebreaks'])
+_django_linebreaksbr = django_filter_to_jinja2(
+    defaultfilters.register.filters['linebreaksbr'])
+
+
+def _normalize_newlines(value):
+    if u'\r' in value:
+        value = value.replace(u'\r\n', u'\n').replace(u'\r', u'\n')
+    return value
+
+
+@library.filter
+@environmentfilter
+def linebreaks(environment, value):
+    """Django's linebreaks filter, the text is escaped once and the newlines
+    are normalized without a regular expression.
+    """
+    if type(value) is not unicode:
+        return _django_linebreaks(environment, value)
+    value = _normalize_newlines(value)
+    if environment.autoescape:
+        value = escape(value)
+    paras = [para.replace(u'\n', u'<br />')
+             for para in re_paragraphs.split(value)]
+    return Markup(u'<p>%s</p>' % u'</p>\n\n<p>'.join(paras))
+
+
+@library.filter
+@environmentfilter
+def linebreaksbr(environment, value):
+    """Django's linebreaksbr filter, the newlines are normalized without a
+    regular expression.
+    """
+    if type(value) is not unicode:
+        return _django_linebreaksbr(environment, value)
+    value = _normalize_newlines(value)
+    if environment.autoescape:
+        value = escape(value)
+    return Markup(value.replace(u'\n', u'<br />'))
+
+
+@library.filter
+@evalcontextfilter
+def urlize(eval_ctx, value, *args):
+    """Jinja2's urlize filter, but only the words which can be a link (they
+    contain a dot, colon or at sign) are inspected.
+    """
+    rv = unicode(Markup.escape(value))
+    if u'.' in rv or u'@' in rv or u':' in rv:
+        words = re_whitespace.split(rv)
+        for i, word in enumerate(words):
+            if u'.' in word or u'@' in word or u':' in word:
+                # Markup, as the word is escaped already
+                words[i] = urlize_text(Markup(word), *args)
+        rv = u''.join(words)
+    if eval_ctx.autoescape:
+        rv = Markup(rv)
+    return rv
 
 
 @library.filter
@@ -119,3 +212,15 @@ def default(value, default_value=u'', boolean=True):
     Django's own version.
     """
     return filters.do_default(value, default_value, boolean)
+
+
+@library.filter
+def chunked(queryset, chunk_size=1000):
+    """Iterate over a queryset in chunks of rows instead of loading all
+    rows in memory at once, for example for large exports::
+
+        {% for obj in objects|chunked(500) %}
+
+    ``loop.length`` costs an extra count query.
+    """
+    return ChunkedQuerySet(queryset, int(chunk_size))
@@ -0,0 +1,122 @@
+"""Conditional responses which skip rendering when the client has the page.
+
+The ETag of a page is computed before rendering from the source of the
+template (and the templates it extends, includes and imports) and a
+fingerprint of the context, for example the modification time of the
+objects shown::
+
+    from django_cofingo.http import render_conditional
+
+    def article(request, pk):
+        article = get_object_or_404(Article, pk=pk)
+        return render_conditional(request, 'news/article.html',
+                                  {'article': article},
+                                  fingerprint=(article.pk, article.modified))
+
+Everything the output depends on must be in the fingerprint, including
+the templates of dynamic includes (``{% include name %}``) and the output of
+the context processors which differs between users, such as the user and
+their messages. Without a fingerprint no ETag is sent.
+"""
+import hashlib
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.encoding import smart_str
+from django.utils.http import parse_etags, quote_etag
+from jinja2 import meta
+
+from django_cofingo import env, render_to_string
+
+
+def template_checksum(template):
+    """Return the checksum of the source of the template and the templates
+    it depends on, the templates must be loaded by name.
+    """
+    checksum = hashlib.sha1()
+    _update_checksum(checksum, template, set())
+    return checksum.hexdigest()
+
+
+def _update_checksum(checksum, template, seen):
+    seen.add(template.name)
+
+    # The checksum of the template itself and the names of its dependencies
+    # are cached on the (compiled) template, which is replaced when the
+    # source changes.
+    info = template.__dict__.get('_checksum_info')
+    if info is None:
+        loader = template.environment.loader
+        if template.name is None or loader is None:
+            raise ValueError('Only templates loaded by name have a checksum')
+        source, filename, uptodate = loader.get_source(
+            template.environment, template.name)
+        ast = template.environment.parse(source, template.name, filename)
+        dependencies = set(
+            name for name in meta.find_referenced_templates(ast)
+            if isinstance(name, basestring))
+        # Templates inlined by the optimizer are no longer referenced
+        dependencies.update(
+            name for name, _ in getattr(template, '_dependencies', ()))
+        dependencies = sorted(dependencies)
+        info = (hashlib.sha1(smart_str(source)).hexdigest(), dependencies)
+        template._checksum_info = info
+
+    own_checksum, dependencies = info
+    checksum.update(own_checksum)
+    for name in dependencies:
+        if name not in seen:
+            dependency = template.environment.get_template(
+                name, template.name)
+            _update_checksum(checksum, dependency, seen)
+
+
+def template_etag(template, fingerprint):
+    """Return the ETag (unquoted) for a render of the template, the
+    fingerprint is a string or a sequence of values which identify the
+    context.
+    """
+    if isinstance(template, basestring):
+        template = env.get_template(template)
+
+    etag = hashlib.sha1(template_checksum(template))
+    if settings.USE_I18N:
+        from django.utils import translation
+        etag.update('\0' + smart_str(translation.get_language()))
+    if not isinstance(fingerprint, (list, tuple)):
+        fingerprint = [fingerprint]
+    for value in fingerprint:
+        etag.update('\0' + smart_str(value))
+    return etag.hexdigest()
+
+
+def render_conditional(request, template, context=None, fingerprint=None,
+                       **response_kwargs):
+    """Like rendering the template into an HttpResponse, but returns a 304
+    Not Modified response without rendering when the ETag of the page
+    matches the If-None-Match header of a GET or HEAD request.
+
+    The fingerprint must identify everything the page shows besides the
+    templates, including the output of the context processors which differs
+    between users (for example ``request.user.pk``). Without a fingerprint
+    the page is rendered without an ETag.
+    """
+    if isinstance(template, basestring):
+        template = env.get_template(template)
+    if fingerprint is None:
+        return HttpResponse(render_to_string(request, template, context),
+                            **response_kwargs)
+    etag = template_etag(template, fingerprint)
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match and request.method in ('GET', 'HEAD'):
+        etags = parse_etags(if_none_match)
+        if etag in etags or '*' in etags:
+            response = HttpResponseNotModified()
+            response['ETag'] = quote_etag(etag)
+            return response
+
+    response = HttpResponse(render_to_string(request, template, context),
+                            **response_kwargs)
+    response['ETag'] = quote_etag(etag)
+    return response
@@ -0,0 +1,51 @@
+"""Constant folding of translations for per-language compiled templates.
+
+With ``COFINGO_I18N_PRECOMPILE = True`` (and ``USE_I18N`` enabled) every
+template is compiled once for each active language. Translations of constant
+strings (``{% trans %}`` blocks without variables, ``_("...")`` and
+``gettext("...")`` calls) are looked up while compiling and end up as static
+output, so no catalog lookup is done while rendering. Pluralized strings and
+strings with variables are still translated while rendering.
+
+Note that a context variable named ``_`` or ``gettext`` no longer replaces
+the translation function for constant strings.
+"""
+from django.utils import translation
+from jinja2 import nodes
+from jinja2.visitor import NodeTransformer
+
+GETTEXT_FUNCTIONS = ('_', 'gettext')
+
+
+class TranslationFolder(NodeTransformer):
+    """Replaces gettext calls with a constant string argument by the
+    translated string.
+    """
+
+    def visit_Call(self, node):
+        node = self.generic_visit(node)
+        if isinstance(node.node, nodes.Name) and \
+                node.node.name in GETTEXT_FUNCTIONS and \
+                len(node.args) == 1 and \
+                isinstance(node.args[0], nodes.Const) and \
+                isinstance(node.args[0].value, basestring) and \
+                not node.kwargs and \
+                node.dyn_args is None and node.dyn_kwargs is None:
+            value = translation.ugettext(node.args[0].value)
+            return nodes.Const(value, lineno=node.lineno)
+        return node
+
+
+def fold_translations(ast, language):
+    """Fold the translations of constant strings in the given template AST
+    for the given language.
+    """
+    previous = translation.get_language()
+    translation.activate(language)
+    try:
+        return TranslationFolder().visit(ast)
+    finally:
+        if previous is None:
+            translation.deactivate()
+        else:
+            translation.activate(previous)
@@ -1,3 +1,40 @@
+import datetime
+import functools
+from decimal import Decimal
+
+from jinja2 import contextfilter
+from jinja2.utils import LRUCache
+
+
+class FilterCacheStats(object):
+    """Hits and misses of a memoized filter (counted without locking, so
+    they are approximate with multiple threads).
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return float(self.hits) / total if total else 0.0
+
+    def __repr__(self):
+        return '<FilterCacheStats hits=%d misses=%d hit_rate=%.2f>' % (
+            self.hits, self.misses, self.hit_rate)
+
+
+# (module of the library, name) of the memoized filter -> FilterCacheStats
+filter_cache_stats = {}
+
+# Argument types whose values can't change, filters with scope 'process' only
+# cache calls with these (and tuples and frozensets of them). A model
+# instance compares equal to its saved version, for example.
+IMMUTABLE_TYPES = (type(None), bool, int, long, float, complex, basestring,
+                   Decimal, datetime.date, datetime.time, datetime.timedelta)
+
+
 class Library(object):
 
     def __init__(self):
@@ -11,11 +48,31 @@ class Library(object):
     def set_env(self, env):
         self.env = env
 
-    def filter(self, func):
-        self.filters[func.__name__] = func
+    def filter(self, func=None, pure=False, cache_size=128, scope='process'):
+        """Register a filter, used as a decorator with or without options::
+
+            @library.filter(pure=True, scope='render')
+            def currency(value):
+                ...
+
+        The results of a pure filter (one which only depends on its
+        arguments) are cached, at most cache_size per filter. With scope
+        'process' the cache is shared by all renders, with scope 'render'
+        it only lives for the duration of a single render. Scope 'process'
+        only caches calls whose arguments are immutable, see IMMUTABLE_TYPES.
+        """
+        if func is None:
+            return lambda func: self.filter(func, pure, cache_size, scope)
+
+        name = func.__name__
+        if pure:
+            func = memoize_filter(func, cache_size, scope)
+
+        self.filters[name] = func
 
         if self.env:
-            self.env.filters[func.__name__] = func
+            self.env.filters[name] = func
+        return func
 
     def attr(self, name, value):
         self.attrs[name] = value
@@ -26,3 +83,94 @@ class Library(object):
         self.extensions.append(extension)
         if self.env:
             self.env.add_extension(extension)
+
+
+def _make_key(args, kwargs):
+    # The types are part of the key, 1 == 1.0 and Markup('a') == u'a'
+    key = tuple((type(arg), arg) for arg in args)
+    if kwargs:
+        key += tuple((name, type(value), value)
+                     for name, value in sorted(kwargs.items()))
+    return key
+
+
+def _is_immutable(value):
+    if isinstance(value, (tuple, frozenset)):
+        return all(_is_immutable(item) for item in value)
+    return isinstance(value, IMMUTABLE_TYPES)
+
+
+def memoize_filter(func, cache_size=128, scope='process'):
+    """Return a filter which caches the results of the pure filter func,
+    see :meth:`Library.filter`.
+    """
+    if getattr(func, 'contextfilter', False):
+        raise TypeError('Context filters can not be memoized')
+    if scope not in ('process', 'render'):
+        raise ValueError('Invalid filter cache scope: %r' % scope)
+
+    stats = filter_cache_stats[(func.__module__, func.__name__)] = \
+        FilterCacheStats()
+    environment_filter = getattr(func, 'environmentfilter', False)
+    evalcontext_filter = getattr(func, 'evalcontextfilter', False)
+    wraps = functools.wraps(func, updated=())
+
+    def get_key(args, kwargs):
+        # The first argument of environment and eval context filters is not
+        # hashable, but the autoescape setting changes the output.
+        if environment_filter or evalcontext_filter:
+            return (args[0].autoescape,) + _make_key(args[1:], kwargs)
+        return _make_key(args, kwargs)
+
+    def call(cache, args, kwargs):
+        try:
+            key = get_key(args, kwargs)
+            rv = cache.get(key, cache)
+        except TypeError:
+            # Unhashable arguments
+            return func(*args, **kwargs)
+        if rv is not cache:
+            stats.hits += 1
+            return rv
+        stats.misses += 1
+        rv = func(*args, **kwargs)
+        if len(cache) < cache_size or scope == 'process':
+            cache[key] = rv
+        return rv
+
+    if scope == 'process':
+        process_cache = LRUCache(cache_size)
+
+        @wraps
+        def wrapper(*args, **kwargs):
+            values = args[1:] if environment_filter or evalcontext_filter \
+                else args
+            if not all(_is_immutable(value) for value in values) or \
+                    not all(_is_immutable(value)
+                            for value in kwargs.itervalues()):
+                return func(*args, **kwargs)
+            return call(process_cache, args, kwargs)
+
+        if environment_filter:
+            wrapper.environmentfilter = True
+        if evalcontext_filter:
+            wrapper.evalcontextfilter = True
+        return wrapper
+
+    @contextfilter
+    @wraps
+    def render_wrapper(context, *args, **kwargs):
+        if environment_filter:
+            args = (context.environment,) + args
+        elif evalcontext_filter:
+            args = (context.eval_ctx,) + args
+
+        memo = context.get('_memo')
+        if type(memo) is not dict:
+            # Not rendered by django_cofingo.Template
+            return func(*args, **kwargs)
+        cache = memo.get(render_wrapper)
+        if cache is None:
+            cache = memo[render_wrapper] = {}
+        return call(cache, args, kwargs)
+    return render_wrapper
@@ -0,0 +1,190 @@
+"""Static analysis of templates for patterns which are slow to render.
+
+Run it on all templates with the ``lint_templates`` management command, it
+exits with an error when an issue is found so it can fail a CI build::
+
+    ./manage.py lint_templates [template names] [--ignore=C002,C003]
+                               [--exclude=registration/]
+
+The checks are:
+
+    C001  ``{% url %}`` inside a loop, reversing is relatively slow
+    C002  a Django filter inside a loop, these run through a conversion layer
+    C003  a queryset method call inside a loop, which runs a query per item
+    C004  ``{% include %}`` inside a loop, consider a macro
+    C005  ``{% spaceless %}`` around a large static block, which is stripped
+          on every render
+    C006  ``{% cache %}`` with a fragment name which is not a constant,
+          use the vary on arguments instead
+
+Loops over a literal list or a ``range()`` of a constant small size are not
+considered loops.
+"""
+from django.conf import settings
+from jinja2 import nodes
+from jinja2.exceptions import TemplateSyntaxError
+
+CHECKS = {
+    'C001': 'url tag inside a loop',
+    'C002': 'Django filter %r inside a loop',
+    'C003': 'queryset method %r called inside a loop',
+    'C004': 'include inside a loop',
+    'C005': 'spaceless tag around %d characters of static content',
+    'C006': 'cache tag with a fragment name which is not a constant',
+}
+
+QUERYSET_METHODS = frozenset([
+    'aggregate', 'all', 'annotate', 'count', 'dates', 'distinct', 'exclude',
+    'exists', 'filter', 'in_bulk', 'latest', 'order_by', 'select_related',
+    'values', 'values_list',
+])
+
+# Loops over less items than this are not considered loops.
+SMALL_LOOP = 10
+
+# Static content in a spaceless tag of this size or larger is reported.
+SPACELESS_THRESHOLD = 1024
+
+
+class Issue(object):
+
+    def __init__(self, template_name, lineno, code, message):
+        self.template_name = template_name
+        self.lineno = lineno
+        self.code = code
+        self.message = message
+
+    def __unicode__(self):
+        return u'%s:%s: %s %s' % (self.template_name, self.lineno,
+                                  self.code, self.message)
+
+    def __str__(self):
+        return unicode(self).encode('utf-8')
+
+    def __repr__(self):
+        return '<Issue %s>' % self
+
+
+class TemplateLinter(object):
+    """Walks the AST of a template and collects the issues."""
+
+    def __init__(self, environment, template_name):
+        self.environment = environment
+        self.template_name = template_name
+
+    def lint(self, ast):
+        self.issues = []
+        self._visit(ast, 0)
+        return self.issues
+
+    def _add(self, node, code, *args):
+        message = CHECKS[code] % args if args else CHECKS[code]
+        self.issues.append(
+            Issue(self.template_name, node.lineno, code, message))
+
+    def _visit(self, node, loops):
+        if isinstance(node, nodes.For):
+            self._visit(node.iter, loops)
+            inner = loops if self._is_small(node.iter) else loops + 1
+            for child in node.body:
+                self._visit(child, inner)
+            if node.test is not None:
+                self._visit(node.test, inner)
+            for child in node.else_:
+                self._visit(child, loops)
+            return
+
+        self._check(node, loops)
+        for child in node.iter_child_nodes():
+            self._visit(child, loops)
+
+    def _is_small(self, node):
+        if isinstance(node, (nodes.List, nodes.Tuple)):
+            return len(node.items) < SMALL_LOOP
+        if isinstance(node, nodes.Call) and \
+                isinstance(node.node, nodes.Name) and \
+                node.node.name == 'range' and node.args and \
+                all(isinstance(arg, nodes.Const) for arg in node.args):
+            try:
+                return len(range(*[arg.value for arg in node.args])) < \
+                    SMALL_LOOP
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def _check(self, node, loops):
+        if loops:
+            if isinstance(node, nodes.Include):
+                self._add(node, 'C004')
+            elif isinstance(node, nodes.Call):
+                if _is_extension_call(node, '_reverse'):
+                    self._add(node, 'C001')
+                elif isinstance(node.node, nodes.Getattr) and \
+                        node.node.attr in QUERYSET_METHODS:
+                    self._add(node, 'C003', node.node.attr)
+            elif isinstance(node, nodes.Filter):
+                func = self.environment.filters.get(node.name)
+                if getattr(func, 'django_filter', None) is not None:
+                    self._add(node, 'C002', node.name)
+
+        if isinstance(node, nodes.CallBlock):
+            if _is_extension_call(node.call, '_strip_spaces'):
+                size = sum(len(data.data)
+                           for data in node.find_all(nodes.TemplateData))
+                if size >= SPACELESS_THRESHOLD:
+                    self._add(node, 'C005', size)
+            elif _is_extension_call(node.call, '_cache_support') and \
+                    not isinstance(node.call.args[1], nodes.Const):
+                self._add(node, 'C006')
+
+
+def _is_extension_call(node, method):
+    return isinstance(node, nodes.Call) and \
+        isinstance(node.node, nodes.ExtensionAttribute) and \
+        node.node.name == method
+
+
+def lint_template(environment, name):
+    """Return the issues found in the template with the given name, a
+    syntax error is reported as an issue with code E001.
+    """
+    source, filename, uptodate = environment.loader.get_source(
+        environment, name)
+    try:
+        ast = environment.parse(source, name, filename)
+    except TemplateSyntaxError as exc:
+        return [Issue(name, exc.lineno, 'E001', exc.message)]
+    return TemplateLinter(environment, name).lint(ast)
+
+
+def list_templates(environment):
+    """Return the names of the templates which are rendered by Jinja2."""
+    from django_cofingo import DEFAULT_EXCLUDE_APPS
+
+    exclude_apps = getattr(settings, 'COFINGO_EXCLUDE_APPS',
+                           DEFAULT_EXCLUDE_APPS)
+    names = set()
+    for loader in getattr(environment.loader, 'loaders',
+                          [environment.loader]):
+        try:
+            names.update(loader.list_templates())
+        except (OSError, TypeError):
+            # A package without a templates directory or a loader which
+            # can't list its templates.
+            continue
+    return sorted(name for name in names
+                  if name.split('/')[0] not in exclude_apps)
+
+
+def lint(environment, names=None, ignore=(), exclude=()):
+    """Lint the given templates (all templates by default, except those
+    starting with one of the prefixes in exclude), returns the issues.
+    """
+    if names is None:
+        names = [name for name in list_templates(environment)
+                 if not name.startswith(tuple(exclude))]
+    issues = []
+    for name in names:
+        issues.extend(issue for issue in lint_template(environment, name)
+                      if issue.code not in ignore)
+    return issues
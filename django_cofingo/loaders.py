@@ -0,0 +1,266 @@
+"""Loader for templates stored in the database.
+
+Enable it with the model and the names of its fields in your settings, the
+templates in the database then take precedence over the files::
+
+    COFINGO_DATABASE_TEMPLATES = {
+        'model': 'pages.PageTemplate',
+        'name_field': 'name',
+        'source_field': 'source',
+    }
+
+All rows are read once into an in-memory mirror, which is kept up to date by
+the post_save and post_delete signals of the model. Only the changed rows are
+refreshed and the compiled templates of those rows are evicted from the
+template caches, rendering a template never queries the database.
+
+A save inside a managed transaction is applied once the transaction has
+ended: the next template load, in any thread, reads the saved rows again, so
+a rollback never reaches the mirror. Every change also increments a version
+in the default cache (see :mod:`django_cofingo.cache`), the other processes
+compare it with the version of their mirror at most every
+``check_interval`` seconds when a template is loaded, and read all rows
+again when it differs.
+"""
+import threading
+import time
+import weakref
+from itertools import count
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import get_model
+from django.db.models.signals import post_delete, post_save
+from jinja2 import BaseLoader, TemplateNotFound
+
+from django_cofingo import cache
+
+
+class DatabaseLoader(BaseLoader):
+    """Load templates from the rows of a model, ``model`` is a model class
+    or an ``'app_label.ModelName'`` string.
+    """
+
+    def __init__(self, model, name_field='name', source_field='source',
+                 check_interval=1):
+        self.model = model
+        self.name_field = name_field
+        self.source_field = source_field
+        self.check_interval = check_interval
+
+        # name -> (source, version) and pk -> name, None until first use
+        self._templates = None
+        self._names = None
+        self._versions = count()
+        # Shared version the mirror was read at, and when to compare it again
+        self._version = None
+        self._next_check = 0
+        # id of a connection -> (connection, depth of its transaction
+        # management, pks of the rows saved in its managed transaction)
+        self._pending = {}
+        self._lock = threading.RLock()
+        self._environments = weakref.WeakKeyDictionary()
+
+    def get_source(self, environment, name):
+        self._environments[environment] = True
+        templates = self._get_templates()
+        try:
+            entry = templates[name]
+        except KeyError:
+            raise TemplateNotFound(name)
+
+        def uptodate():
+            templates = self._templates
+            return templates is not None and templates.get(name) is entry
+        return entry[0], None, uptodate
+
+    def list_templates(self):
+        return sorted(self._get_templates())
+
+    def reload(self):
+        """Read all rows from the database again, the templates which
+        changed are evicted from the template caches.
+        """
+        with self._lock:
+            old = self._templates
+            if old is None:
+                return
+            self._templates = None
+            new = self._get_templates()
+            names = set(old) - set(new)
+            for name, entry in new.items():
+                if name in old and old[name][0] == entry[0]:
+                    new[name] = old[name]   # still up to date
+                else:
+                    names.add(name)
+        for name in names:
+            self._invalidate(name)
+
+    def check(self):
+        """Refresh the rows saved in transactions which have ended, and
+        reload all rows if another process changed them. Called by the
+        environment whenever a template is loaded.
+        """
+        if self._pending:
+            self._apply_pending()
+
+        now = time.time()
+        if self._templates is None or now < self._next_check:
+            return
+        self._next_check = now + self.check_interval
+        if cache.get_versions([self._get_tag()])[0] != self._version:
+            self.reload()
+
+    def _get_model(self):
+        if isinstance(self.model, basestring):
+            self.model = get_model(*self.model.split('.', 1))
+        return self.model
+
+    def _get_tag(self):
+        return u'templates:%s' % cache.get_tag(self._get_model())
+
+    def _get_templates(self):
+        templates = self._templates
+        if templates is not None:
+            return templates
+
+        with self._lock:
+            if self._templates is None:
+                model = self._get_model()
+                dispatch_uid = 'django_cofingo.loaders.%d' % id(self)
+                post_save.connect(self._on_save, sender=model,
+                                  dispatch_uid=dispatch_uid)
+                post_delete.connect(self._on_delete, sender=model,
+                                    dispatch_uid=dispatch_uid)
+
+                # Read before the rows, a change made meanwhile is picked up
+                # by the next check.
+                self._version = cache.get_versions([self._get_tag()])[0]
+                templates, names = {}, {}
+                rows = model._default_manager.values_list(
+                    'pk', self.name_field, self.source_field)
+                for pk, name, source in rows:
+                    templates[name] = (source, next(self._versions))
+                    names[pk] = name
+                self._names = names
+                self._templates = templates
+            return self._templates
+
+    def _defer(self, instance, using):
+        """Return True if the change is part of a managed transaction, the
+        row is then refreshed by check() once the transaction has ended.
+        """
+        connection = connections[using or DEFAULT_DB_ALIAS]
+        if not connection.is_managed():
+            return False
+        with self._lock:
+            pending = self._pending.get(id(connection))
+            if pending is None:
+                pending = self._pending[id(connection)] = (
+                    connection, len(connection.transaction_state), set())
+            pending[2].add(instance.pk)
+        return True
+
+    def _apply_pending(self):
+        pks = set()
+        with self._lock:
+            for key, (connection, depth, saved) in self._pending.items():
+                if len(connection.transaction_state) < depth or \
+                        not connection.is_managed():
+                    del self._pending[key]
+                    pks.update(saved)
+        if not pks:
+            return
+
+        # Committed or rolled back, the database has the current rows
+        rows = dict((pk, (name, source)) for pk, name, source in
+                    self._get_model()._default_manager.filter(
+                        pk__in=pks).values_list(
+                        'pk', self.name_field, self.source_field))
+        with self._lock:
+            if self._templates is None:
+                return
+            names = set()
+            for pk in pks:
+                if pk in rows:
+                    names.update(self._set_row(pk, *rows[pk]))
+                else:
+                    names.update(self._remove_row(pk))
+        for name in names:
+            self._invalidate(name)
+        if names:
+            self._changed()
+
+    def _set_row(self, pk, name, source):
+        """Update the mirror, return the names of the changed templates. Call
+        with the lock held.
+        """
+        old_name = self._names.get(pk)
+        if old_name == name and self._templates[name][0] == source:
+            return ()
+        names = [name]
+        if old_name is not None and old_name != name:
+            self._templates.pop(old_name, None)
+            names.append(old_name)
+        self._names[pk] = name
+        self._templates[name] = (source, next(self._versions))
+        return names
+
+    def _remove_row(self, pk):
+        name = self._names.pop(pk, None)
+        if name is None:
+            return ()
+        self._templates.pop(name, None)
+        return (name,)
+
+    def _changed(self):
+        """Tell the other processes about a change applied to the mirror."""
+        tag = self._get_tag()
+        version = cache.get_versions([tag])[0]
+        cache.invalidate(tag)
+        with self._lock:
+            if self._version == version:
+                new_version = cache.get_versions([tag])[0]
+                if new_version == version + 1:
+                    # No other change in between, no need to reload
+                    self._version = new_version
+
+    def _on_save(self, sender, instance, using=None, **kwargs):
+        if self._defer(instance, using):
+            return
+        with self._lock:
+            if self._templates is None:
+                return
+            names = self._set_row(instance.pk,
+                                  getattr(instance, self.name_field),
+                                  getattr(instance, self.source_field))
+        for name in names:
+            self._invalidate(name)
+        if names:
+            self._changed()
+
+    def _on_delete(self, sender, instance, using=None, **kwargs):
+        if self._defer(instance, using):
+            return
+        with self._lock:
+            if self._templates is None:
+                return
+            names = self._remove_row(instance.pk)
+        for name in names:
+            self._invalidate(name)
+        if names:
+            self._changed()
+
+    def _invalidate(self, name):
+        """Evict the template from the caches of the environments which
+        loaded templates from this loader, the caches are not checked for
+        changes unless auto_reload is enabled.
+        """
+        for environment in list(self._environments.keys()):
+            invalidate = getattr(environment, 'invalidate_template', None)
+            if invalidate is not None:
+                invalidate(name)
+            elif environment.cache is not None:
+                try:
+                    del environment.cache[name]
+                except KeyError:
+                    pass
@@ -0,0 +1,32 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = ('Report template patterns which are slow to render, see '
+            'django_cofingo.lint for the checks.')
+    args = '[template_name ...]'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--ignore', dest='ignore', default='',
+                    help='Comma separated codes of the checks to skip.'),
+        make_option('--exclude', dest='exclude', default='',
+                    help='Comma separated prefixes of template names to '
+                         'skip, when no names are given.'),
+    )
+
+    def handle(self, *names, **options):
+        from django_cofingo import env
+        from django_cofingo.lint import lint
+
+        ignore = self._split(options['ignore'])
+        exclude = self._split(options['exclude'])
+        issues = lint(env, names or None, ignore, exclude)
+        for issue in issues:
+            self.stdout.write('%s\n' % issue)
+        if issues:
+            raise CommandError('%d issues found' % len(issues))
+
+    def _split(self, value):
+        return [item.strip() for item in value.split(',') if item.strip()]
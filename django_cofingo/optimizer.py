@@ -0,0 +1,383 @@
+"""Compile time inlining of includes and flattening of inheritance chains.
+
+With ``COFINGO_OPTIMIZE_TEMPLATES = True`` templates loaded by name are
+optimized when they are compiled:
+
+* ``{% include "name.html" %}`` with a constant name is replaced by the
+  source of the included template, saving the ``get_template`` call, the new
+  context and the generator per include at render time.
+* A template which extends a constant template name is compiled as a single
+  template with the blocks of the chain already resolved.
+
+Only what can be inlined without changing the output is: includes of
+templates which extend, define blocks or import with context are left
+alone, as are inheritance chains using ``super()`` or ``self``, and includes
+with ``ignore missing``, ``without context`` or a dynamic name.
+
+The compiled template records the names and checksums of the templates it
+inlines. It is out of date when any of them changes (with
+``auto_reload``), :meth:`Environment.invalidate_template` also removes the
+templates which inline the invalidated one, and code loaded from the
+bytecode cache is compiled again when an inlined template has changed.
+
+Templates are optimized when they are compiled, :meth:`Environment.parse`
+still returns the AST of the source as written. The lines of an inlined
+template keep their own name and number in tracebacks, in the query reports
+of :mod:`django_cofingo.debug` and in the profiler.
+"""
+import copy
+import hashlib
+
+from django.conf import settings
+from jinja2 import nodes
+from jinja2.exceptions import TemplateNotFound, TemplateSyntaxError
+from jinja2.visitor import NodeTransformer
+
+# Includes and extends are resolved at most this many templates deep.
+MAX_DEPTH = 10
+
+# Name of the variable in the module of the compiled template which holds
+# the (name, checksum) pairs of the templates it inlines.
+DEPENDENCIES_NAME = '__cofingo_dependencies__'
+
+# Name of the variable which holds the (name, filename) of the templates
+# whose lines are inlined. The lines of the n-th are numbered from
+# n * LINE_REGION in the compiled template.
+LINE_MAP_NAME = '__cofingo_line_map__'
+LINE_REGION = 1000000
+
+
+def is_enabled():
+    return bool(getattr(settings, 'COFINGO_OPTIMIZE_TEMPLATES', False))
+
+
+def source_checksum(source):
+    if isinstance(source, unicode):
+        source = source.encode('utf-8')
+    return hashlib.sha1(source).hexdigest()
+
+
+def _uses_self(ast):
+    return any(node.name == 'self' for node in ast.find_all(nodes.Name))
+
+
+def _uses_super(ast):
+    return any(isinstance(node.node, nodes.Name) and node.node.name == 'super'
+               for node in ast.find_all(nodes.Call))
+
+
+def _block_names(ast):
+    return set(block.name for block in ast.find_all(nodes.Block))
+
+
+def _is_whitespace(node):
+    return isinstance(node, nodes.Output) and all(
+        isinstance(child, nodes.TemplateData) and not child.data.strip()
+        for child in node.nodes)
+
+
+class TemplateOptimizer(NodeTransformer):
+    """Optimizes the AST of one template, the templates it inlines are
+    collected in dependencies (name -> checksum of the source).
+    """
+
+    def __init__(self, environment, name, stack=(), asts=None):
+        self.environment = environment
+        self.name = name
+        self.stack = stack + (name,)
+        self.dependencies = {}
+        # name -> (optimized AST, dependencies), shared by the optimizers of
+        # one template.
+        self.asts = {} if asts is None else asts
+
+    def optimize(self, ast):
+        ast = self.visit(ast)
+        return self.flatten(ast)
+
+    def load(self, name):
+        """Return a copy of the optimized AST of the template, or None if it
+        can't be loaded.
+        """
+        if name in self.stack or len(self.stack) >= MAX_DEPTH:
+            return None
+        if name not in self.asts:
+            self.asts[name] = None
+            try:
+                source, filename, uptodate = \
+                    self.environment.loader.get_source(self.environment, name)
+                ast = self.environment._parse(source, name, filename)
+            except (TemplateNotFound, TemplateSyntaxError):
+                # Left to the include or extends tag at render time.
+                return None
+            for node in ast.find_all(nodes.Node):
+                node.cofingo_origin = (name, filename)
+            optimizer = TemplateOptimizer(self.environment, name, self.stack,
+                                          self.asts)
+            ast = optimizer.optimize(ast)
+            dependencies = dict(optimizer.dependencies)
+            dependencies[name] = source_checksum(source)
+            self.asts[name] = (ast, dependencies)
+
+        if self.asts[name] is None:
+            return None
+        ast, dependencies = self.asts[name]
+        self.dependencies.update(dependencies)
+        # The AST is inserted as is, the environment is not copied.
+        return copy.deepcopy(ast, {id(self.environment): self.environment})
+
+    def _constant_name(self, node):
+        if not isinstance(node, nodes.Const) or \
+                not isinstance(node.value, basestring):
+            return None
+        return self.environment.join_path(node.value, self.name)
+
+    def visit_Include(self, node):
+        name = self._constant_name(node.template)
+        if name is None or node.ignore_missing or not node.with_context:
+            return node
+        ast = self.load(name)
+        if ast is None or not self.can_inline(ast):
+            return node
+        scope = nodes.Scope(ast.body, lineno=node.lineno)
+        scope.set_environment(self.environment)
+        scope.cofingo_include = node
+        scope.cofingo_origin = getattr(node, 'cofingo_origin', None)
+        return scope
+
+    def can_inline(self, ast):
+        if ast.find(nodes.Extends) is not None or \
+                ast.find(nodes.Block) is not None or _uses_self(ast):
+            return False
+        # The context of an import with context differs once inlined
+        for node in ast.find_all((nodes.Import, nodes.FromImport)):
+            if node.with_context:
+                return False
+        return True
+
+    def flatten(self, ast):
+        """Return the AST of the template with its parents merged in, or the
+        AST itself if the chain can't be resolved statically.
+        """
+        extends = list(ast.find_all(nodes.Extends))
+        if len(extends) != 1 or \
+                not any(node is extends[0] for node in ast.body):
+            return ast
+        extends = extends[0]
+        name = self._constant_name(extends.template)
+        if name is None or _uses_super(ast) or _uses_self(ast):
+            return ast
+
+        # Output before the extends tag is rendered, anything else after it
+        # but blocks would have to run.
+        index = ast.body.index(extends)
+        before, after = ast.body[:index], ast.body[index + 1:]
+        if not all(isinstance(node, nodes.Output) for node in before) or \
+                not all(isinstance(node, nodes.Block) or _is_whitespace(node)
+                        for node in after):
+            return ast
+
+        dependencies = dict(self.dependencies)
+        parent = self.load(name)
+        if parent is None or parent.find(nodes.Extends) is not None or \
+                _uses_self(parent):
+            self.dependencies = dependencies
+            return ast
+
+        blocks = dict((block.name, block)
+                      for block in ast.find_all(nodes.Block))
+        block_names = set(blocks) | _block_names(parent)
+        body = before + BlockReplacer(blocks).visit(parent).body
+
+        # A block which is not rendered by the merged template is still
+        # available to render_block(), so these chains are left alone.
+        template = nodes.Template(body, lineno=1)
+        if _block_names(template) != block_names:
+            self.dependencies = dependencies
+            return ast
+        template.set_environment(self.environment)
+        return template
+
+
+class BlockReplacer(NodeTransformer):
+    """Replaces the blocks of a parent by those of the child."""
+
+    def __init__(self, blocks):
+        self.blocks = blocks
+
+    def visit_Block(self, node):
+        block = self.blocks.get(node.name)
+        if block is None:
+            return self.generic_visit(node)
+        return block
+
+
+def _assigned_names(ast):
+    names = set()
+    for node in ast.find_all((nodes.Name, nodes.Macro, nodes.Import,
+                              nodes.FromImport, nodes.For)):
+        if isinstance(node, nodes.Name):
+            if node.ctx in ('store', 'param'):
+                names.add(node.name)
+        elif isinstance(node, nodes.Macro):
+            names.add(node.name)
+        elif isinstance(node, nodes.Import):
+            names.add(node.target)
+        elif isinstance(node, nodes.FromImport):
+            names.update(name if isinstance(name, basestring) else name[1]
+                         for name in node.names)
+        else:
+            names.add('loop')
+    return names
+
+
+class IncludeRestorer(NodeTransformer):
+    """Puts back the includes which assign names the rest of the template
+    uses. The compiler resets the names assigned in a scope when it ends,
+    which would hide the values from the context.
+    """
+
+    def __init__(self, ast):
+        self.ast = ast
+
+    def visit_Scope(self, node):
+        include = getattr(node, 'cofingo_include', None)
+        if include is not None:
+            inside = set(id(name) for name in node.find_all(nodes.Name))
+            used = set(name.name for name in self.ast.find_all(nodes.Name)
+                       if id(name) not in inside)
+            if used & _assigned_names(node):
+                return include
+        return self.generic_visit(node)
+
+
+def optimize(environment, ast, name):
+    """Return the optimized AST of the template, the names and checksums of
+    the templates it inlines are stored as the cofingo_dependencies
+    attribute.
+    """
+    optimizer = TemplateOptimizer(environment, name)
+    ast = IncludeRestorer(ast).visit(optimizer.optimize(ast))
+    ast.cofingo_dependencies = tuple(sorted(optimizer.dependencies.items()))
+    ast.cofingo_line_map = _number_lines(ast, name)
+    return ast
+
+
+def _number_lines(ast, name):
+    """Move the lines of the inlined templates to their own region, return
+    the (name, filename) of the templates by region.
+    """
+    origins = []
+    for node in ast.find_all(nodes.Node):
+        origin = getattr(node, 'cofingo_origin', None)
+        if origin is None or origin[0] == name or node.lineno is None:
+            continue
+        if origin not in origins:
+            origins.append(origin)
+        node.lineno += (origins.index(origin) + 1) * LINE_REGION
+    return tuple(origins)
+
+
+def source_location(line_map, name, filename, lineno):
+    """Return the name, filename and line number in its own template of a
+    line of a compiled template.
+    """
+    region = lineno // LINE_REGION
+    if region and region <= len(line_map):
+        name, filename = line_map[region - 1]
+        lineno %= LINE_REGION
+    return name, filename, lineno
+
+
+def remap_syntax_error(error, line_map):
+    """Report a compile error in inlined code in the inlined template."""
+    error.name, error.filename, error.lineno = source_location(
+        line_map, error.name, error.filename, error.lineno)
+
+
+def make_traceback(exc_info, source_hint=None):
+    """Like ``jinja2.debug.make_traceback``, with the frames of inlined code
+    at the line of the template they come from.
+    """
+    from jinja2 import debug
+
+    if isinstance(exc_info[1], TemplateSyntaxError):
+        exc_info = debug.translate_syntax_error(exc_info[1], source_hint)
+        initial_skip = 0
+    else:
+        initial_skip = 1
+    tb = exc_info[2]
+    for x in xrange(initial_skip):
+        if tb is not None:
+            tb = tb.tb_next
+
+    frames = []
+    while tb is not None:
+        if tb.tb_frame.f_code in debug.internal_code:
+            tb = tb.tb_next
+            continue
+        next = tb.tb_next
+        template = tb.tb_frame.f_globals.get('__jinja_template__')
+        if template is not None:
+            if hasattr(template, 'get_source_location'):
+                name, filename, lineno = \
+                    template.get_source_location(tb.tb_lineno)
+            else:
+                filename = template.filename
+                lineno = template.get_corresponding_lineno(tb.tb_lineno)
+            tb = debug.fake_exc_info(exc_info[:2] + (tb,), filename,
+                                     lineno)[2]
+        frames.append(debug.make_frame_proxy(tb))
+        tb = next
+
+    if not frames:
+        raise exc_info[0], exc_info[1], exc_info[2]
+    return debug.ProcessedTraceback(exc_info[0], exc_info[1], frames)
+
+
+def dependency_checks(template):
+    """Return the uptodate functions of the templates the template inlines,
+    or None if any of them has changed since it was compiled.
+    """
+    environment = template.environment
+    checks = []
+    for name, checksum in template._dependencies:
+        try:
+            source, filename, uptodate = \
+                environment.loader.get_source(environment, name)
+        except TemplateNotFound:
+            return None
+        if source_checksum(source) != checksum:
+            return None
+        if uptodate is not None:
+            checks.append(uptodate)
+    return checks
+
+
+def recompile(template):
+    """Compile the template from its source, updating the bytecode cache."""
+    environment = template.environment
+    source, filename, uptodate = environment.loader.get_source(
+        environment, template.name)
+    code = environment.compile(source, template.name, filename)
+    bcc = environment.bytecode_cache
+    if bcc is not None:
+        bucket = bcc.get_bucket(environment, template.name, filename, source)
+        bucket.code = code
+        bcc.set_bucket(bucket)
+    return code
+
+
+def track_dependencies(template, uptodate, checks):
+    """Make the template out of date when one of the templates it inlines
+    changes, and register it as their dependent for invalidate_template().
+    """
+    dependents = getattr(template.environment, '_dependents', None)
+    if dependents is not None:
+        for name, checksum in template._dependencies:
+            dependents.setdefault(name, set()).add(template.name)
+
+    def is_up_to_date():
+        if uptodate is not None and not uptodate():
+            return False
+        return all(check() for check in checks)
+    template._uptodate = is_up_to_date
@@ -0,0 +1,135 @@
+"""Sampling profiler which reports the template lines the time is spent on.
+
+A background thread samples the stack of the profiled thread at a fixed
+interval, compiled template frames are mapped back to the template name and
+line number::
+
+    from django_cofingo.profiler import SamplingProfiler
+
+    with SamplingProfiler(interval=0.001) as profiler:
+        template.render(context)
+    print profiler.report()
+    profiler.save_folded('render.folded')
+
+The folded stacks can be turned into a flame graph with ``flamegraph.pl`` or
+opened in speedscope. As it only samples, the overhead is low enough to
+profile a running site, but short renders need many samples.
+"""
+import sys
+import threading
+
+from django_cofingo.debug import frame_location
+
+
+def _format_location(location):
+    name, lineno = location
+    return '%s:%d' % (name or '<string>', lineno)
+
+
+class SamplingProfiler(object):
+    """Samples the stack of a thread (by default the thread which starts
+    the profiler) every interval seconds. With templates_only=False the
+    Python frames are part of the stacks as well.
+    """
+
+    def __init__(self, interval=0.005, thread_id=None, templates_only=True):
+        self.interval = interval
+        self.thread_id = thread_id
+        self.templates_only = templates_only
+
+        self.samples = 0
+        self.stacks = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.thread_id is None:
+            self.thread_id = threading.current_thread().ident
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='cofingo-profiler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.stop()
+
+    def _run(self):
+        while True:
+            self._stop.wait(self.interval)
+            if self._stop.is_set():
+                return
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.sample(frame)
+            del frame
+
+    def sample(self, frame):
+        """Record the stack of the given frame."""
+        stack = []
+        while frame is not None:
+            location = frame_location(frame)
+            code = frame.f_code
+            if location is not None:
+                line = _format_location(location)
+                label = line
+                if code.co_name != 'root':
+                    # block_* and macro functions
+                    label = '%s %s' % (line, code.co_name)
+                stack.append((label, line))
+            elif not self.templates_only:
+                stack.append(('%s (%s:%d)' % (code.co_name, code.co_filename,
+                                              frame.f_lineno), None))
+            frame = frame.f_back
+        if not stack:
+            return
+        stack = tuple(reversed(stack))
+        self.samples += 1
+        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def folded(self):
+        """Return the stacks in the folded format of flamegraph.pl, one
+        ``frame;frame;frame count`` line per stack.
+        """
+        return '\n'.join('%s %d' % (';'.join(label for label, _ in stack),
+                                    count)
+                         for stack, count in sorted(self.stacks.iteritems()))
+
+    def save_folded(self, path):
+        with open(path, 'w') as fh:
+            fh.write(self.folded() + '\n')
+
+    def hot_lines(self):
+        """Return (line, self samples, total samples) tuples for all template
+        lines, the lines with the most samples of their own first.
+        """
+        own = {}
+        total = {}
+        for stack, count in self.stacks.iteritems():
+            templates = [line for label, line in stack if line is not None]
+            if templates:
+                own[templates[-1]] = own.get(templates[-1], 0) + count
+            for frame in set(templates):
+                total[frame] = total.get(frame, 0) + count
+        return sorted(((line, own.get(line, 0), count)
+                       for line, count in total.iteritems()),
+                      key=lambda item: (-item[1], -item[2], item[0]))
+
+    def report(self, limit=20):
+        lines = ['%d samples' % self.samples,
+                 '%8s %8s  %s' % ('self', 'total', 'line')]
+        for line, own, total in self.hot_lines()[:limit]:
+            lines.append('%7.1f%% %7.1f%%  %s' % (
+                100.0 * own / self.samples, 100.0 * total / self.samples,
+                line))
+        return '\n'.join(lines)
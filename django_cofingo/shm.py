@@ -0,0 +1,275 @@
+"""Cache backend in a memory-mapped file shared by the processes of a host.
+
+Meant for the fragments of the ``{% cache %}`` tag: a fragment rendered by
+one worker is served to all workers on the host, without a network hop and
+without a copy per process::
+
+    CACHES = {
+        'default': {...},
+        'fragments': {
+            'BACKEND': 'django_cofingo.shm.SharedMemoryCache',
+            'LOCATION': '/dev/shm/myproject-fragments',
+            'OPTIONS': {'SLOTS': 8192, 'SLOT_SIZE': 16384},
+        },
+    }
+    COFINGO_FRAGMENT_CACHE = 'fragments'
+
+The file is a hash table of SLOTS fixed size slots, in buckets of WAYS
+slots. A key can only be stored in the slots of its bucket, when these are
+all in use the least recently used entry of the bucket is evicted. Values
+larger than a slot (SLOT_SIZE minus a 40 byte header) are not stored, so
+compress large fragments with ``COFINGO_CACHE_COMPRESS_THRESHOLD``.
+
+Writes lock their bucket (with ``fcntl.lockf`` between processes and a lock
+per bucket stripe within the process). Reads take no locks: every slot has a
+sequence number which is odd while it is written, a read which sees the
+number change is retried.
+
+Every process using the file must use the same options. Keys are stored as
+their MD5 digest.
+"""
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from django.core.cache.backends.base import BaseCache
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.encoding import smart_str
+from django.utils.hashcompat import md5_constructor
+
+MAGIC = 'COFSHM01'
+
+# magic, slots, slot size, ways
+HEADER = struct.Struct('<8sIII')
+HEADER_SIZE = 64
+
+# sequence number, key digest, expiry time (0 for an empty slot), last
+# access time, length of the value
+SLOT = struct.Struct('<I16sddI')
+SEQUENCE = struct.Struct('<I')
+ACCESSED = struct.Struct('<d')
+ACCESSED_OFFSET = 4 + 16 + 8
+
+# Number of times a read is retried while the slot is being written.
+READ_ATTEMPTS = 3
+
+# Number of locks which serialize the writes of the threads of a process.
+THREAD_LOCK_STRIPES = 64
+
+EMPTY = '\0' * 16
+
+
+class SharedMemoryCache(BaseCache):
+
+    def __init__(self, location, params):
+        super(SharedMemoryCache, self).__init__(params)
+        if not location:
+            raise ImproperlyConfigured(
+                'SharedMemoryCache needs the path of a file as LOCATION')
+        options = params.get('OPTIONS', {})
+        self.path = location
+        self.slots = int(options.get('SLOTS', 4096))
+        self.slot_size = int(options.get('SLOT_SIZE', 8192))
+        self.ways = int(options.get('WAYS', 8))
+        if self.slots < self.ways or self.slot_size <= SLOT.size:
+            raise ImproperlyConfigured('Invalid SharedMemoryCache options')
+
+        self.buckets = self.slots // self.ways
+        self.max_value_size = self.slot_size - SLOT.size
+        self._size = HEADER_SIZE + self.buckets * self.ways * self.slot_size
+        self._thread_locks = [threading.Lock()
+                              for i in xrange(THREAD_LOCK_STRIPES)]
+        self._open_lock = threading.Lock()
+        self._fd = None
+        self._map = None
+
+    def _open(self):
+        with self._open_lock:
+            if self._map is not None:
+                return self._map
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0600)
+            header = HEADER.pack(MAGIC, self.slots, self.slot_size, self.ways)
+            fcntl.lockf(fd, fcntl.LOCK_EX, HEADER_SIZE, 0, os.SEEK_SET)
+            try:
+                if os.fstat(fd).st_size == 0:
+                    os.ftruncate(fd, self._size)
+                    os.write(fd, header)
+                    valid = True
+                else:
+                    valid = os.read(fd, HEADER.size) == header
+            finally:
+                fcntl.lockf(fd, fcntl.LOCK_UN, HEADER_SIZE, 0, os.SEEK_SET)
+            if not valid:
+                os.close(fd)
+                raise ImproperlyConfigured(
+                    '%s was created with other SharedMemoryCache options'
+                    % self.path)
+            self._fd = fd
+            self._map = mmap.mmap(fd, self._size)
+            return self._map
+
+    def _locate(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        digest = md5_constructor(smart_str(key)).digest()
+        bucket = struct.unpack('<Q', digest[:8])[0] % self.buckets
+        return digest, bucket
+
+    def _slot_offsets(self, bucket):
+        start = HEADER_SIZE + bucket * self.ways * self.slot_size
+        return range(start, start + self.ways * self.slot_size,
+                     self.slot_size)
+
+    @contextmanager
+    def _lock(self, bucket):
+        length = self.ways * self.slot_size
+        start = HEADER_SIZE + bucket * length
+        with self._thread_locks[bucket % THREAD_LOCK_STRIPES]:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, length, start, os.SEEK_SET)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, length, start,
+                            os.SEEK_SET)
+
+    def _read(self, digest, bucket, now):
+        """Return (offset, pickled value) of the live entry of the key, or
+        (None, None). Takes no locks.
+        """
+        data = self._map
+        if data is None:
+            data = self._open()
+        for attempt in xrange(READ_ATTEMPTS):
+            for offset in self._slot_offsets(bucket):
+                sequence, slot_digest, expires, accessed, length = \
+                    SLOT.unpack_from(data, offset)
+                if slot_digest != digest:
+                    continue
+                start = offset + SLOT.size
+                value = data[start:start + length]
+                if sequence % 2 or \
+                        SEQUENCE.unpack_from(data, offset)[0] != sequence:
+                    break   # being written, try again
+                if not expires or expires <= now:
+                    return None, None
+                return offset, value
+            else:
+                return None, None
+        return None, None
+
+    def _find(self, digest, bucket):
+        """Return the offset of the slot for the key, one which holds it, is
+        empty or expired, or else the least recently used one. Call with the
+        bucket locked.
+        """
+        now = time.time()
+        free = None
+        oldest = None
+        for offset in self._slot_offsets(bucket):
+            sequence, slot_digest, expires, accessed, length = \
+                SLOT.unpack_from(self._map, offset)
+            if slot_digest == digest and expires:
+                return offset
+            if free is None and (not expires or expires <= now):
+                free = offset
+            if oldest is None or accessed < oldest[0]:
+                oldest = (accessed, offset)
+        return free if free is not None else oldest[1]
+
+    def _write(self, offset, digest, expires, value):
+        """Store the entry in the slot, call with the bucket locked."""
+        data = self._map
+        sequence = SEQUENCE.unpack_from(data, offset)[0]
+        SEQUENCE.pack_into(data, offset, sequence + 1)
+        start = offset + SLOT.size
+        data[start:start + len(value)] = value
+        SLOT.pack_into(data, offset, sequence + 1, digest, expires,
+                       time.time(), len(value))
+        SEQUENCE.pack_into(data, offset, (sequence + 2) & 0xffffffff)
+
+    def _expires(self, timeout):
+        if timeout is None:
+            timeout = self.default_timeout
+        return time.time() + timeout
+
+    def _dumps(self, value):
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(value) > self.max_value_size:
+            return None
+        return value
+
+    def get(self, key, default=None, version=None):
+        digest, bucket = self._locate(key, version)
+        offset, value = self._read(digest, bucket, time.time())
+        if offset is None:
+            return default
+        # Not locked, at worst the time of another entry is updated
+        ACCESSED.pack_into(self._map, offset + ACCESSED_OFFSET, time.time())
+        try:
+            return pickle.loads(value)
+        except Exception:
+            return default
+
+    def set(self, key, value, timeout=None, version=None):
+        self._store(key, value, timeout, version, replace=True)
+
+    def add(self, key, value, timeout=None, version=None):
+        return self._store(key, value, timeout, version, replace=False)
+
+    def _store(self, key, value, timeout, version, replace):
+        digest, bucket = self._locate(key, version)
+        value = self._dumps(value)
+        if self._map is None:
+            self._open()
+        with self._lock(bucket):
+            if not replace and \
+                    self._read(digest, bucket, time.time())[0] is not None:
+                return False
+            offset = self._find(digest, bucket)
+            if value is None:
+                # Too large, don't leave an old value behind
+                if SLOT.unpack_from(self._map, offset)[1] == digest:
+                    self._write(offset, EMPTY, 0, '')
+                return False
+            self._write(offset, digest, self._expires(timeout), value)
+        return True
+
+    def delete(self, key, version=None):
+        digest, bucket = self._locate(key, version)
+        if self._map is None:
+            self._open()
+        with self._lock(bucket):
+            offset = self._find(digest, bucket)
+            if SLOT.unpack_from(self._map, offset)[1] == digest:
+                self._write(offset, EMPTY, 0, '')
+
+    def incr(self, key, delta=1, version=None):
+        digest, bucket = self._locate(key, version)
+        if self._map is None:
+            self._open()
+        with self._lock(bucket):
+            offset, value = self._read(digest, bucket, time.time())
+            if offset is None:
+                raise ValueError("Key '%s' not found" % key)
+            new_value = pickle.loads(value) + delta
+            expires = SLOT.unpack_from(self._map, offset)[2]
+            self._write(offset, digest, expires, self._dumps(new_value))
+        return new_value
+
+    def clear(self):
+        if self._map is None:
+            self._open()
+        for bucket in xrange(self.buckets):
+            with self._lock(bucket):
+                for offset in self._slot_offsets(bucket):
+                    if SLOT.unpack_from(self._map, offset)[2]:
+                        self._write(offset, EMPTY, 0, '')
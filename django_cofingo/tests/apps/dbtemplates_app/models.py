@@ -0,0 +1,6 @@
+from django.db import models
+
+
+class DbTemplate(models.Model):
+    name = models.CharField(max_length=100, unique=True)
+    source = models.TextField()
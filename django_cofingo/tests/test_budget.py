@@ -0,0 +1,74 @@
+from django.conf import settings
+from django.test import TestCase
+
+
+class TestRenderBudget(TestCase):
+
+    def setUp(self):
+        settings.COFINGO_RENDER_BUDGET = {'iterations': 100, 'output': 500}
+
+    def tearDown(self):
+        del settings.COFINGO_RENDER_BUDGET
+
+    def test_within_budget(self):
+        from django_cofingo import env
+
+        template = env.from_string(
+            '{% for i in range(10) %}{{ loop.length }}{% endfor %}')
+        self.assertEqual(template.render({}), '10' * 10)
+
+    def test_iterations(self):
+        from django_cofingo import env
+        from django_cofingo.budget import RenderBudgetExceeded, budget_exceeded
+
+        exceeded = []
+
+        def handler(sender, **kwargs):
+            exceeded.append((kwargs['kind'], kwargs['value']))
+        budget_exceeded.connect(handler)
+
+        try:
+            template = env.from_string(
+                '{% for i in range(20) %}{% for j in range(10) %}'
+                '{% endfor %}{% endfor %}')
+            with self.assertRaises(RenderBudgetExceeded) as cm:
+                template.render({})
+        finally:
+            budget_exceeded.disconnect(handler)
+        self.assertEqual(cm.exception.kind, 'iterations')
+        self.assertEqual(exceeded, [('iterations', 101)])
+
+    def test_output(self):
+        from django_cofingo import env
+        from django_cofingo.budget import RenderBudgetExceeded
+
+        template = env.from_string('{{ x }}{{ x }}')
+        with self.assertRaises(RenderBudgetExceeded) as cm:
+            template.render({'x': 'x' * 300})
+        self.assertEqual(cm.exception.kind, 'output')
+
+    def test_time(self):
+        import time
+        from django_cofingo import env
+        from django_cofingo.budget import RenderBudgetExceeded
+
+        settings.COFINGO_TEMPLATE_BUDGETS = {'slow.html': {'time': 0.05}}
+        try:
+            template = env.from_string(
+                '{% for i in range(1000) %}{{ sleep() }}{% endfor %}')
+            template.name = 'slow.html'
+            with self.assertRaises(RenderBudgetExceeded) as cm:
+                template.render({'sleep': lambda: time.sleep(0.01) or ''})
+        finally:
+            del settings.COFINGO_TEMPLATE_BUDGETS
+        self.assertEqual(cm.exception.kind, 'time')
+
+    def test_render_block(self):
+        from django_cofingo import Template, env
+        from django_cofingo.budget import RenderBudgetExceeded
+
+        template = env.from_string(
+            '{% block loop %}{% for i in range(200) %}{% endfor %}'
+            '{% endblock %}', template_class=Template)
+        with self.assertRaises(RenderBudgetExceeded):
+            template.render_block('loop')
@@ -0,0 +1,140 @@
+import logging
+
+from django.conf import settings
+from django.test import TestCase
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class TestQueryAccounting(TestCase):
+
+    def test_record_queries(self):
+        from django.contrib.auth.models import User
+        from django.db import connection
+        from django_cofingo import env
+        from django_cofingo.debug import record_queries
+
+        tmpl = env.from_string(
+            '{{ users.count() }}\n'
+            '{% for i in range(2) %}{{ users.count() }}{% endfor %}')
+        with record_queries() as report:
+            tmpl.render({'users': User.objects.all()})
+            User.objects.count()
+
+        self.assertEqual(report.count, 4)
+        self.assertEqual(
+            dict((key, value[0]) for key, value in report.lines.items()),
+            {(None, 1): 1, (None, 2): 2, None: 1})
+        self.assertEqual(report.by_template()[None][0], 4)
+        self.assertTrue('<string>:2' in unicode(report))
+
+        # the connection is restored
+        self.assertFalse(connection.use_debug_cursor)
+
+    def test_nested(self):
+        from django.contrib.auth.models import User
+        from django_cofingo.debug import record_queries
+
+        with record_queries() as outer:
+            User.objects.count()
+            with record_queries() as inner:
+                User.objects.count()
+        self.assertEqual(outer.count, 2)
+        self.assertEqual(inner.count, 1)
+
+    def test_threshold_warning(self):
+        from django.contrib.auth.models import User
+        from django_cofingo import env
+
+        handler = ListHandler()
+        logger = logging.getLogger('django_cofingo')
+        logger.addHandler(handler)
+        settings.COFINGO_QUERY_ACCOUNTING = True
+        settings.COFINGO_QUERY_WARNING_THRESHOLD = 2
+        try:
+            tmpl = env.from_string(
+                '{% for i in range(3) %}{{ users.count() }}{% endfor %}')
+            tmpl.render({'users': User.objects.all()})
+        finally:
+            del settings.COFINGO_QUERY_ACCOUNTING
+            del settings.COFINGO_QUERY_WARNING_THRESHOLD
+            logger.removeHandler(handler)
+
+        warnings = [r for r in handler.records if r.levelno == logging.WARNING]
+        self.assertEqual(len(warnings), 1)
+        self.assertEqual(warnings[0].args[1], 3)
+
+    def test_queryset_warning(self):
+        from django.contrib.auth.models import User
+        from django_cofingo import env
+
+        for i in range(3):
+            User.objects.create(username='user%d' % i)
+
+        handler = ListHandler()
+        logger = logging.getLogger('django_cofingo')
+        logger.addHandler(handler)
+        settings.COFINGO_QUERYSET_WARNING_THRESHOLD = 3
+        try:
+            tmpl = env.from_string(
+                '{% for user in users %}{{ user.username }}{% endfor %}')
+            tmpl.render({'users': User.objects.all()})
+            tmpl = env.from_string(
+                '{% for user in users|chunked(2) %}{{ user.username }}'
+                '{% endfor %}')
+            tmpl.render({'users': User.objects.all()})
+        finally:
+            del settings.COFINGO_QUERYSET_WARNING_THRESHOLD
+            logger.removeHandler(handler)
+
+        warnings = [r for r in handler.records if r.levelno == logging.WARNING]
+        self.assertEqual(len(warnings), 1)
+        self.assertEqual(warnings[0].args[1:], (3, 'users'))
+
+
+class TestSamplingProfiler(TestCase):
+
+    def test_sample(self):
+        import sys
+        from django_cofingo import env
+        from django_cofingo.profiler import SamplingProfiler
+
+        profiler = SamplingProfiler()
+
+        class Probe(object):
+            def __call__(self):
+                profiler.sample(sys._getframe())
+                return ''
+
+            def __unicode__(self):
+                return self()
+
+        env.get_template('fullstack_app/child.html').render(
+            {'name': Probe(), 'content': Probe()})
+        self.assertEqual(profiler.samples, 2)
+        self.assertEqual(profiler.folded().splitlines(), [
+            'fullstack_app/child.html:1;fullstack_app/base.html:1;'
+            'fullstack_app/child.html:2 block_title 1',
+            'fullstack_app/child.html:1;fullstack_app/base.html:2;'
+            'fullstack_app/base.html:2 block_content 1',
+        ])
+        self.assertEqual(profiler.hot_lines()[0][1:], (1, 1))
+        self.assertTrue('fullstack_app/base.html:2' in profiler.report())
+
+    def test_profile_thread(self):
+        import time
+        from django_cofingo import env
+        from django_cofingo.profiler import SamplingProfiler
+
+        template = env.from_string('{{ x }}\n{{ sleep() }}')
+        with SamplingProfiler(interval=0.001) as profiler:
+            template.render({'sleep': lambda: time.sleep(0.05) or ''})
+        self.assertTrue(profiler.samples > 0)
+        self.assertEqual(profiler.hot_lines()[0][0], '<string>:2')
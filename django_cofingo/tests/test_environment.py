@@ -16,7 +16,7 @@ class TestEnvironment(TestCase):
         tmpl = env.from_string('{{ foo.item }}', {'foo': Foo()})
         self.assertEqual(tmpl.render(), '')
 
-    def test_getattr(self):
+    def test_getitem(self):
         from django_cofingo import env
 
         class Foo(object):
@@ -25,3 +25,78 @@ class TestEnvironment(TestCase):
 
         tmpl = env.from_string("{{ foo['item'] }}", {'foo': Foo()})
         self.assertEqual(tmpl.render(), '')
+
+    def test_getattr_dict(self):
+        from django_cofingo import env
+
+        tmpl = env.from_string('{{ d.key }}|{{ d.missing }}|{{ d.keys()[0] }}')
+        self.assertEqual(tmpl.render({'d': {'key': 'value'}}), 'value||key')
+
+        # dict attributes take precedence over the items
+        tmpl = env.from_string('{{ d.keys is callable }}')
+        self.assertEqual(tmpl.render({'d': {'keys': 'value'}}), 'True')
+
+
+class TestFromStringCache(TestCase):
+
+    def setUp(self):
+        from django.conf import settings
+        settings.COFINGO_FROM_STRING_CACHE_SIZE = 2
+
+    def tearDown(self):
+        from django.conf import settings
+        del settings.COFINGO_FROM_STRING_CACHE_SIZE
+
+    def test_cache(self):
+        from django_cofingo import env, get_from_string_cache
+
+        cache = get_from_string_cache()
+        template = env.from_string(u'{{ x }} cached')
+        self.assertTrue(env.from_string('{{ x }} cached') is template)
+        self.assertEqual(template.render({'x': 1}), '1 cached')
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        # Different globals
+        other = env.from_string('{{ x }} cached', {'x': 2})
+        self.assertFalse(other is template)
+        self.assertEqual(other.render(), '2 cached')
+        self.assertTrue(env.from_string('{{ x }} cached', {'x': 2}) is other)
+
+        # Unhashable globals are not cached
+        self.assertFalse(env.from_string('{{ x }}', {'x': []}) is
+                         env.from_string('{{ x }}', {'x': []}))
+
+        env.from_string('{{ x }} evicts')
+        self.assertEqual(cache.evictions, 1)
+        self.assertFalse(env.from_string('{{ x }} cached') is template)
+
+    def test_bytecode_cache(self):
+        from django.conf import settings
+        from jinja2 import BytecodeCache
+        from django_cofingo import env
+
+        class MemoryBytecodeCache(BytecodeCache):
+            def __init__(self):
+                self.storage = {}
+
+            def load_bytecode(self, bucket):
+                if bucket.key in self.storage:
+                    bucket.bytecode_from_string(self.storage[bucket.key])
+
+            def dump_bytecode(self, bucket):
+                self.storage[bucket.key] = bucket.bytecode_to_string()
+
+        test_env = env.overlay(bytecode_cache=MemoryBytecodeCache())
+        settings.COFINGO_FROM_STRING_BYTECODE_CACHE = True
+        try:
+            test_env.from_string('{{ x }} stored')
+            self.assertEqual(len(test_env.bytecode_cache.storage), 1)
+
+            # A new process (simulated by an empty template cache) loads the
+            # compiled code from the bytecode cache
+            settings.COFINGO_FROM_STRING_CACHE_SIZE = 3
+            test_env.compile = None
+            template = test_env.from_string('{{ x }} stored')
+            self.assertEqual(template.render({'x': 1}), '1 stored')
+        finally:
+            del settings.COFINGO_FROM_STRING_BYTECODE_CACHE
@@ -1,5 +1,6 @@
-from jinja2 import Environment
+from django.conf import settings
 from django.test import TestCase
+from jinja2 import Environment
 
 
 class TestLoadExtension(TestCase):
@@ -21,6 +22,224 @@ class TestLoadExtension(TestCase):
             '')
 
 
+class TestMemoExtension(TestCase):
+    def setUp(self):
+        from django_cofingo.extensions import MemoExtension
+        self.env = Environment(extensions=[MemoExtension])
+
+    def _from_string(self, source):
+        from django_cofingo import Template
+        return self.env.from_string(source, template_class=Template)
+
+    def test_memo(self):
+        calls = []
+
+        def widget(value):
+            calls.append(value)
+            return '<%s>' % value
+
+        template = self._from_string(
+            '{% for x in items %}'
+            '{% memo x %}{{ widget(x) }}{% endmemo %}'
+            '{% endfor %}')
+        result = template.render({'items': [1, 2, 1, 1], 'widget': widget})
+        self.assertEqual(result, '<1><2><1><1>')
+        self.assertEqual(calls, [1, 2])
+
+        # the memo does not outlive the render
+        template.render({'items': [1], 'widget': widget})
+        self.assertEqual(calls, [1, 2, 1])
+
+    def test_memo_unhashable(self):
+        template = self._from_string(
+            '{% for x in items %}{% memo x %}{{ x }}{% endmemo %}{% endfor %}')
+        result = template.render({'items': [[1], [2]]})
+        self.assertEqual(result, '[1][2]')
+
+    def test_memo_types(self):
+        from jinja2 import Markup
+        from jinja2.utils import concat
+        from django_cofingo import Template
+        from django_cofingo.extensions import MemoExtension
+
+        env = Environment(extensions=[MemoExtension], autoescape=True)
+        template = env.from_string(
+            '{% for x in items %}{% memo x %}{{ x }}{% endmemo %}{% endfor %}',
+            template_class=Template)
+        result = template.render({'items': [Markup('<b>'), u'<b>', 1, True]})
+        self.assertEqual(result, '<b>&lt;b&gt;1True')
+
+        # Templates without a name don't share their fragments
+        other = env.from_string('{% memo 1 %}b{% endmemo %}')
+
+        def render_other(memo):
+            return concat(other.root_render_func(
+                other.new_context({'_memo': memo})))
+
+        template = env.from_string(
+            '{% memo 1 %}a{% endmemo %}{{ render_other(_memo) }}',
+            template_class=Template)
+        self.assertEqual(template.render({'render_other': render_other}),
+                         'ab')
+
+    def test_memo_reproducible(self):
+        source = '{% memo 1 %}a{% endmemo %}{% memo 1 %}b{% endmemo %}'
+        self.assertEqual(self.env.compile(source, 'memo.html', raw=True),
+                         self.env.compile(source, 'memo.html', raw=True))
+        self.assertEqual(self._from_string(source).render(), 'ab')
+
+    def test_memo_without_cofingo_template(self):
+        template = self.env.from_string('{% memo 1 %}a{% endmemo %}')
+        self.assertEqual(template.render(), 'a')
+
+
+class TestParallelExtension(TestCase):
+    def setUp(self):
+        from jinja2 import DictLoader
+        from django_cofingo.extensions import ParallelExtension
+        self.env = Environment(
+            extensions=[ParallelExtension], autoescape=True,
+            loader=DictLoader({
+                'a.html': '<a>{{ x }}</a>',
+                'b.html': '{{ wait() }}<b>{{ x }}</b>',
+            }))
+
+    def test_parallel(self):
+        import time
+        result = self.env.from_string(
+            '{% parallel %}'
+            '{% include "b.html" %}-{% include "a.html" %}'
+            '{% include "missing.html" ignore missing %}'
+            '{% endparallel %}').render(
+                {'x': 1, 'wait': lambda: time.sleep(0.1) or ''})
+        self.assertEqual(result, '<b>1</b>-<a>1</a>')
+
+    def test_parallel_timeout(self):
+        import time
+        result = self.env.from_string(
+            '{% parallel 0.05 "<i>n/a</i>" %}'
+            '{% include "a.html" %}{% include "b.html" %}'
+            '{% endparallel %}').render(
+                {'x': 1, 'wait': lambda: time.sleep(0.5) or ''})
+        self.assertEqual(result, '<a>1</a>&lt;i&gt;n/a&lt;/i&gt;')
+
+    def test_parallel_exception(self):
+        def wait():
+            raise ValueError()
+
+        template = self.env.from_string(
+            '{% parallel %}{% include "b.html" %}{% endparallel %}')
+        with self.assertRaises(ValueError):
+            template.render({'wait': wait})
+
+    def test_parallel_request_state(self):
+        from django.utils import translation
+        from django_cofingo import budget, tracing
+        from django_cofingo.debug import active_reports, record_queries
+
+        seen = []
+
+        def wait():
+            seen.append((translation.get_language(), budget.current(),
+                         tracing.current(), active_reports()))
+            return ''
+
+        template = self.env.from_string(
+            '{% parallel %}{% include "b.html" %}{% endparallel %}')
+        translation.activate('de')
+        try:
+            with tracing.trace() as tracer:
+                with budget.RenderBudget('t', {}) as render_budget:
+                    with record_queries() as report:
+                        template.render({'wait': wait})
+        finally:
+            translation.deactivate()
+        self.assertEqual(seen, [('de', render_budget, tracer, [report])])
+
+    def test_parallel_invalid_body(self):
+        from jinja2.exceptions import TemplateSyntaxError
+        with self.assertRaises(TemplateSyntaxError):
+            self.env.from_string(
+                '{% parallel %}{{ x }}{% include "a.html" %}{% endparallel %}')
+
+
+class TestCacheInvalidation(TestCase):
+    def setUp(self):
+        from django_cofingo.extensions import CacheExtension
+        self.env = Environment(extensions=[CacheExtension])
+
+    def test_invalidate_tag(self):
+        from django_cofingo.cache import invalidate
+
+        template = self.env.from_string(
+            '{% cache 500 "tagged" tags=["news"] %}{{ x }}{% endcache %}')
+        self.assertEqual(template.render({'x': 1}), '1')
+        self.assertEqual(template.render({'x': 2}), '1')
+
+        invalidate('news')
+        self.assertEqual(template.render({'x': 3}), '3')
+
+    def test_invalidate_on_save(self):
+        from django.contrib.auth.models import User
+        from django_cofingo.cache import register
+
+        register(User)
+        user = User.objects.create(username='foo')
+        other = User.objects.create(username='bar')
+
+        template = self.env.from_string(
+            '{% cache 500 "user" user.pk tags=user %}{{ user.username }}'
+            '{% endcache %}')
+        model_template = self.env.from_string(
+            '{% cache 500 "users" tags=[user.__class__] %}{{ x }}'
+            '{% endcache %}')
+        self.assertEqual(template.render({'user': user}), 'foo')
+        self.assertEqual(template.render({'user': other}), 'bar')
+        self.assertEqual(model_template.render({'user': user, 'x': 1}), '1')
+
+        user.username = 'baz'
+        user.save()
+        self.assertEqual(template.render({'user': user}), 'baz')
+        self.assertEqual(template.render({'user': other}), 'bar')
+        self.assertEqual(model_template.render({'user': user, 'x': 2}), '2')
+
+
+class TestCacheCompression(TestCase):
+    def setUp(self):
+        from django_cofingo.extensions import CacheExtension
+        self.env = Environment(extensions=[CacheExtension], autoescape=True)
+        settings.COFINGO_CACHE_COMPRESS_THRESHOLD = 100
+
+    def tearDown(self):
+        del settings.COFINGO_CACHE_COMPRESS_THRESHOLD
+
+    def test_compress(self):
+        from django_cofingo.cache import compression_stats
+
+        compression_stats.reset()
+        template = self.env.from_string(
+            '{% cache 500 "compressed" %}{{ x }}{% for i in range(50) %}'
+            '<p>{{ y }}</p>{% endfor %}{% endcache %}')
+        first = template.render({'x': u'\u2603', 'y': '<b>'})
+        self.assertEqual(compression_stats.compressed, 1)
+        self.assertTrue(compression_stats.bytes_saved > 0)
+        self.assertEqual(template.render({'x': 1, 'y': 2}), first)
+        self.assertEqual(compression_stats.decompressed, 1)
+
+        # Fragments below the threshold are stored as is
+        template = self.env.from_string(
+            '{% cache 500 "small" %}<p>{{ x }}</p>{% endcache %}')
+        self.assertEqual(template.render({'x': '<'}), '<p>&lt;</p>')
+        self.assertEqual(template.render({'x': 1}), '<p>&lt;</p>')
+        self.assertEqual(compression_stats.compressed, 1)
+
+    def test_unknown_version(self):
+        from django_cofingo.cache import decompress_fragment
+
+        self.assertEqual(decompress_fragment('cofingo.z9u...'), None)
+        self.assertEqual(decompress_fragment(u'plain'), u'plain')
+
+
 class TestSpacelessExtension(TestCase):
 
     def test_spaceless(self):
@@ -79,3 +79,141 @@ class TestFilters(TestCase):
             assert r('a{{ d|%s }}b' % f) == 'ab'
             assert r('a{{ d|%s }}b' % f, {'d': None}) == 'ab'
 
+
+class TestFastFilters(TestCase):
+    """The filters with a fast path must return exactly the same as the
+    original implementation.
+    """
+    values = [
+        u'', u'plain text', u'  spaced \t text  ', u'caf\xe9 \u2603',
+        u'one\ntwo', u'one\n\ntwo\n\n\nthree', u'dos\r\nline\rbreaks',
+        u'\n\nleading and trailing\n', u'\r\r\n\n<b>mixed</b>\r\n\r\n& more',
+        u'\n', u'\r',
+        u'<p>Some <b>bold</b> text</p>', u'fish &amp; chips', u'a < b > c',
+        u'"quotes" & \'apostrophes\'', u'visit www.example.com today',
+        u'http://example.com/', u'mail me@example.com', u'time 12:30',
+        u'<a href="x">link</a> and more words here',
+        u'words-with-dashes and_underscores <br/>&nbsp;',
+        u'<div><p>Nested <em>tags with many</em> words</p></div>',
+        'byte string', 1234, None,
+    ]
+
+    def get_values(self):
+        from jinja2 import Markup
+        from django.utils.safestring import mark_safe
+        for value in self.values:
+            yield value
+            if isinstance(value, basestring):
+                yield Markup(value)
+                yield mark_safe(value)
+
+    def assertSame(self, result, expected, value):
+        self.assertEqual((type(result), result), (type(expected), expected),
+                         'Different result for %r' % (value,))
+
+    def test_linebreaks(self):
+        from django.template.defaultfilters import register
+        from jinja2 import Environment
+        from django_cofingo import filters
+        from django_cofingo.utils import django_filter_to_jinja2
+
+        for autoescape in (True, False):
+            env = Environment(autoescape=autoescape)
+            for name in ('linebreaks', 'linebreaksbr'):
+                fast = filters.library.filters[name]
+                original = django_filter_to_jinja2(register.filters[name])
+                for value in self.get_values():
+                    self.assertSame(fast(env, value), original(env, value),
+                                    value)
+
+    def test_urlize(self):
+        from jinja2 import Environment
+        from jinja2.filters import do_urlize
+        from jinja2.nodes import EvalContext
+        from django_cofingo import filters
+
+        fast = filters.library.filters['urlize']
+        for autoescape in (True, False):
+            eval_ctx = EvalContext(Environment(autoescape=autoescape))
+            for value in self.get_values():
+                for args in ((), (10, True)):
+                    self.assertSame(fast(eval_ctx, value, *args),
+                                    do_urlize(eval_ctx, value, *args), value)
+
+    def test_truncatewords_html(self):
+        import warnings
+        from django.utils.text import truncate_html_words
+        from django_cofingo import filters
+
+        fast = filters.library.filters['truncatewords_html']
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', PendingDeprecationWarning)
+            for value in self.get_values():
+                if value is None:
+                    continue
+                for length in range(-1, 8):
+                    self.assertSame(fast(value, length),
+                                    truncate_html_words(value, length), value)
+
+
+class TestChunkedFilter(TestCase):
+
+    def setUp(self):
+        from django.contrib.auth.models import User
+        for i in range(5):
+            User.objects.create(username='user%d' % i)
+
+    def test_unordered(self):
+        from django.contrib.auth.models import User
+        from django_cofingo import env
+
+        users = User.objects.all()
+        tmpl = env.from_string(
+            '{% for user in users|chunked(2) %}'
+            '{{ user.username[-1] }}/{{ loop.length }} {% endfor %}')
+        self.assertEqual(tmpl.render({'users': users}),
+                         '0/5 1/5 2/5 3/5 4/5 ')
+        self.assertEqual(users._result_cache, None)
+
+    def test_ordered(self):
+        from django.contrib.auth.models import User
+        from django_cofingo import env
+
+        tmpl = env.from_string(
+            '{% for user in users|chunked(2) %}'
+            '{{ user.username[-1] }}{% endfor %}')
+        users = User.objects.order_by('-username')
+        self.assertEqual(tmpl.render({'users': users}), '43210')
+        self.assertEqual(tmpl.render({'users': users[1:3]}), '32')
+        self.assertEqual(tmpl.render({'users': users.reverse()}), '01234')
+
+    def test_non_unique_ordering(self):
+        from django.contrib.auth.models import User
+        from django_cofingo.utils import ChunkedQuerySet
+
+        User.objects.filter(username__in=['user1', 'user3']).update(
+            first_name='b')
+        users = User.objects.order_by('-first_name')
+        self.assertEqual(
+            [user.username for user in ChunkedQuerySet(users, 2)],
+            ['user1', 'user3', 'user0', 'user2', 'user4'])
+
+        # the queries are paginated on the ordering and the primary key
+        with self.assertNumQueries(3):
+            [user for user in ChunkedQuerySet(users, 2)]
+
+    def test_values(self):
+        from django.contrib.auth.models import User
+        from django_cofingo.utils import ChunkedQuerySet
+
+        users = User.objects.order_by('username')
+        self.assertEqual(
+            list(ChunkedQuerySet(users.values('username'), 2)),
+            [{'username': 'user%d' % i} for i in range(5)])
+        self.assertEqual(
+            list(ChunkedQuerySet(users.values_list('username', 'email'), 2)),
+            [('user%d' % i, '') for i in range(5)])
+        self.assertEqual(
+            list(ChunkedQuerySet(
+                users.values_list('username', flat=True), 2)),
+            ['user%d' % i for i in range(5)])
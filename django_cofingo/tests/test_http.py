@@ -0,0 +1,59 @@
+from django.test import TestCase
+from django.test.client import RequestFactory
+
+
+class TestConditionalResponse(TestCase):
+
+    def test_template_checksum(self):
+        import jinja2
+        from django_cofingo import env
+        from django_cofingo.http import template_checksum
+
+        templates = {
+            'base.html': '{% block title %}{% endblock %}',
+            'child.html': '{% extends "base.html" %}{% include name %}',
+        }
+        test_env = env.overlay(loader=jinja2.DictLoader(templates),
+                               cache_size=0)
+
+        checksum = template_checksum(test_env.get_template('child.html'))
+        self.assertEqual(
+            template_checksum(test_env.get_template('child.html')), checksum)
+
+        templates['base.html'] = '{% block title %}Changed{% endblock %}'
+        self.assertNotEqual(
+            template_checksum(test_env.get_template('child.html')), checksum)
+
+        self.assertRaises(ValueError, template_checksum,
+                          test_env.from_string('Hello'))
+
+    def test_render_conditional(self):
+        from django_cofingo.http import render_conditional
+
+        factory = RequestFactory()
+        response = render_conditional(
+            factory.get('/'), 'fullstack_app/hello.html', {'name': 'x'},
+            fingerprint=1)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, 'Hello x!')
+        etag = response['ETag']
+
+        response = render_conditional(
+            factory.get('/', HTTP_IF_NONE_MATCH=etag),
+            'fullstack_app/hello.html', {'name': 'x'}, fingerprint=1)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        response = render_conditional(
+            factory.get('/', HTTP_IF_NONE_MATCH=etag),
+            'fullstack_app/hello.html', {'name': 'y'}, fingerprint=2)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        # Without a fingerprint the page is always rendered
+        response = render_conditional(
+            factory.get('/', HTTP_IF_NONE_MATCH='*'),
+            'fullstack_app/hello.html', {'name': 'z'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, 'Hello z!')
+        self.assertFalse(response.has_header('ETag'))
@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.test import TestCase
+from django.utils import translation
+
+
+class TestTranslationFolding(TestCase):
+
+    def setUp(self):
+        settings.COFINGO_I18N_PRECOMPILE = True
+
+    def tearDown(self):
+        del settings.COFINGO_I18N_PRECOMPILE
+        translation.deactivate()
+
+    def test_compile(self):
+        from django_cofingo import env
+        code = env._get_language_env('nl').compile(
+            '{% trans %}Yes{% endtrans %}{{ _("No") }}'
+            '{% trans count=n %}1 year{% pluralize %}n years{% endtrans %}',
+            raw=True)
+        self.assertTrue(u"u'Ja'" in code)
+        self.assertTrue(u"u'Nee'" in code)
+        self.assertFalse("'gettext'" in code)
+        self.assertTrue("'ngettext'" in code)
+
+    def test_get_template(self):
+        from django_cofingo import env
+
+        translation.activate('nl')
+        template = env.get_template('fullstack_app/i18n.html')
+        self.assertEqual(template.environment.fold_language, 'nl')
+        self.assertEqual(template.render({'n': 2}), 'Ja Nee 2 years')
+
+        # The folded translations don't depend on the active language
+        translation.activate('en')
+        self.assertEqual(template.render({'n': 2}), 'Ja Nee 2 years')
+
+        template = env.get_template('fullstack_app/i18n.html')
+        self.assertEqual(template.render({'n': 1}), 'Yes No 1 year')
@@ -11,3 +11,68 @@ class TestLibrary(TestCase):
             return 'filter({})'.format(value)
 
         library.filter(func)
+
+    def test_pure_filter(self):
+        from datetime import date
+        from django_cofingo.library import filter_cache_stats
+
+        library = Library()
+        calls = []
+
+        @library.filter(pure=True)
+        def pure_process(value):
+            calls.append(value)
+            return u'<%s>' % value
+
+        self.assertEqual(pure_process(1), u'<1>')
+        self.assertEqual(pure_process(1), u'<1>')
+        self.assertEqual(pure_process(1.0), u'<1.0>')
+        self.assertEqual(pure_process([]), u'<[]>')
+        self.assertEqual(pure_process(date(2012, 1, 2)), u'<2012-01-02>')
+        self.assertEqual(pure_process(date(2012, 1, 2)), u'<2012-01-02>')
+        self.assertEqual(calls, [1, 1.0, [], date(2012, 1, 2)])
+
+        stats = filter_cache_stats[(__name__, 'pure_process')]
+        self.assertEqual((stats.hits, stats.misses), (2, 3))
+        self.assertEqual(library.filters['pure_process'], pure_process)
+
+    def test_render_scope(self):
+        from jinja2 import environmentfilter
+        from django_cofingo import env
+        from django_cofingo.library import filter_cache_stats
+
+        library = Library()
+        calls = []
+
+        @library.filter(pure=True, scope='render', cache_size=2)
+        @environmentfilter
+        def pure_render(environment, value):
+            calls.append(value)
+            return u'<%s>' % value
+
+        test_env = env.overlay()
+        test_env.filters = dict(env.filters, pure_render=pure_render)
+        template = test_env.from_string(
+            '{% for i in [1, 2, 1, 3, 3, 2] %}{{ i|pure_render }}{% endfor %}')
+        self.assertEqual(template.render({}),
+                         '&lt;1&gt;&lt;2&gt;&lt;1&gt;&lt;3&gt;&lt;3&gt;&lt;2&gt;')
+        self.assertEqual(calls, [1, 2, 3, 3])
+
+        template.render({})
+        self.assertEqual(len(calls), 8)
+        self.assertEqual(filter_cache_stats[(__name__, 'pure_render')].hits, 4)
+
+    def test_process_scope_mutable(self):
+        from django.contrib.auth.models import User
+
+        library = Library()
+
+        @library.filter(pure=True)
+        def username(user):
+            return user.username
+
+        user = User.objects.create(username='before')
+        self.assertEqual(username(user), 'before')
+        # Equal to the first instance, but with another username
+        self.assertEqual(username(User(pk=user.pk, username='after')),
+                         'after')
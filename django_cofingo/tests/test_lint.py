@@ -0,0 +1,70 @@
+from django.conf import settings
+from django.test import TestCase
+
+
+class TestLint(TestCase):
+
+    def lint(self, source):
+        from django_cofingo import env
+        from django_cofingo.lint import TemplateLinter
+
+        ast = env.parse(source)
+        return [(issue.lineno, issue.code)
+                for issue in TemplateLinter(env, 'test.html').lint(ast)]
+
+    def test_loops(self):
+        self.assertEqual(self.lint(
+            '{% for obj in objects %}\n'
+            '{% url "home" %}\n'
+            '{{ obj.name|capfirst }}{{ obj.name|upper }}\n'
+            '{{ obj.tags.count() }}{{ obj.get_name() }}\n'
+            '{% include "row.html" %}\n'
+            '{% endfor %}'),
+            [(2, 'C001'), (3, 'C002'), (4, 'C003'), (5, 'C004')])
+
+    def test_outside_loops(self):
+        self.assertEqual(self.lint(
+            '{% for obj in objects.all() %}{% endfor %}'
+            '{% url "home" %}{{ name|capfirst }}{% include "row.html" %}'
+            '{% for i in range(3) %}{% include "row.html" %}{% endfor %}'
+            '{% for i in [1, 2] %}{% url "home" %}{% endfor %}'), [])
+
+    def test_render_budget(self):
+        # Loops are wrapped for the budget when compiled, not when parsed
+        settings.COFINGO_RENDER_BUDGET = {'iterations': 100}
+        try:
+            self.assertEqual(self.lint(
+                '{% for i in range(3) %}{% include "row.html" %}'
+                '{% endfor %}'), [])
+        finally:
+            del settings.COFINGO_RENDER_BUDGET
+
+    def test_blocks(self):
+        self.assertEqual(self.lint(
+            '{% spaceless %}' + '<p>text</p>' * 100 + '{% endspaceless %}\n'
+            '{% spaceless %}<p>{{ x }}</p>{% endspaceless %}\n'
+            '{% cache 60 "name" %}{% endcache %}\n'
+            '{% cache 60 "name" + x %}{% endcache %}'),
+            [(1, 'C005'), (4, 'C006')])
+
+    def test_command(self):
+        from StringIO import StringIO
+        import jinja2
+        from django.core.management import call_command
+        from django_cofingo import env
+        from django_cofingo.lint import lint
+
+        test_env = env.overlay(loader=jinja2.DictLoader({
+            'good.html': '{{ x }}',
+            'bad.html': '{% for x in y %}{% include "good.html" %}{% endfor %}',
+            'broken.html': '{% for %}',
+        }))
+        self.assertEqual(
+            [(issue.template_name, issue.code) for issue in lint(test_env)],
+            [('bad.html', 'C004'), ('broken.html', 'E001')])
+        self.assertEqual(lint(test_env, ['bad.html'], ignore=['C004']), [])
+
+        stdout = StringIO()
+        call_command('lint_templates', 'fullstack_app/index.html',
+                     'fullstack_app/child.html', stdout=stdout)
+        self.assertEqual(stdout.getvalue(), '')
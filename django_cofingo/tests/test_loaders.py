@@ -0,0 +1,135 @@
+from django.conf import settings
+from django.test import TransactionTestCase
+
+
+class TestDatabaseLoader(TransactionTestCase):
+
+    def setUp(self):
+        from django_cofingo import Environment
+        from apps.dbtemplates_app.models import DbTemplate
+
+        DbTemplate.objects.create(name='page.html', source='Hello {{ name }}')
+        settings.COFINGO_DATABASE_TEMPLATES = {
+            'model': 'dbtemplates_app.DbTemplate', 'check_interval': 0}
+        try:
+            self.env = Environment()
+        finally:
+            del settings.COFINGO_DATABASE_TEMPLATES
+
+    def test_load(self):
+        from jinja2 import TemplateNotFound
+
+        self.assertEqual(
+            self.env.get_template('page.html').render({'name': 'x'}),
+            'Hello x')
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                self.env.get_template('page.html').render({'name': 'y'}),
+                'Hello y')
+            self.assertRaises(TemplateNotFound,
+                              self.env.get_template, 'missing.html')
+
+        # files are still found
+        self.env.get_template('fullstack_app/hello.html')
+
+    def test_changes(self):
+        from jinja2 import TemplateNotFound
+        from apps.dbtemplates_app.models import DbTemplate
+
+        template = self.env.get_template('page.html')
+        self.assertTrue(template.is_up_to_date)
+
+        obj = DbTemplate.objects.get(name='page.html')
+        obj.source = 'Bye {{ name }}'
+        obj.save()
+        self.assertFalse(template.is_up_to_date)
+        self.assertEqual(
+            self.env.get_template('page.html').render({'name': 'x'}),
+            'Bye x')
+
+        obj.name = 'other.html'
+        obj.save()
+        self.assertRaises(TemplateNotFound,
+                          self.env.get_template, 'page.html')
+        self.assertEqual(
+            self.env.get_template('other.html').render({'name': 'x'}),
+            'Bye x')
+
+        obj.delete()
+        self.assertRaises(TemplateNotFound,
+                          self.env.get_template, 'other.html')
+
+    def test_transactions(self):
+        from django.db import transaction
+        from apps.dbtemplates_app.models import DbTemplate
+
+        def render():
+            return self.env.get_template('page.html').render({'name': 'x'})
+
+        render()
+        obj = DbTemplate.objects.get(name='page.html')
+        with transaction.commit_manually():
+            obj.source = 'Bye {{ name }}'
+            obj.save()
+            self.assertEqual(render(), 'Hello x')
+            transaction.rollback()
+        self.assertEqual(render(), 'Hello x')
+
+        with transaction.commit_on_success():
+            obj.save()
+            self.assertEqual(render(), 'Hello x')
+        self.assertEqual(render(), 'Bye x')
+
+    def test_other_thread(self):
+        import threading
+        from django.db import connection, transaction
+        from apps.dbtemplates_app.models import DbTemplate
+
+        DbTemplate.objects.create(name='other.html', source='Other')
+        loader = self.env._database_loader
+        self.env.get_template('page.html')
+        other = loader._templates['other.html']
+
+        obj = DbTemplate.objects.get(name='page.html')
+        with transaction.commit_on_success():
+            obj.source = 'Bye {{ name }}'
+            obj.save()
+
+        # This thread doesn't load templates anymore, another one does
+        results = []
+
+        def render():
+            try:
+                results.append(self.env.get_template('page.html').render(
+                    {'name': 'x'}))
+            finally:
+                connection.close()
+        thread = threading.Thread(target=render)
+        thread.start()
+        thread.join()
+        self.assertEqual(results, ['Bye x'])
+        # Only the saved row was read again
+        self.assertTrue(loader._templates['other.html'] is other)
+
+    def test_other_process(self):
+        import time
+        from django_cofingo import cache
+        from apps.dbtemplates_app.models import DbTemplate
+
+        loader = self.env._database_loader
+        self.assertEqual(
+            self.env.get_template('page.html').render({'name': 'x'}),
+            'Hello x')
+
+        # Saved by another process, which increments the shared version
+        DbTemplate.objects.update(source='Bye {{ name }}')
+        loader._next_check = time.time() + 60
+        cache.invalidate(loader._get_tag())
+        self.assertEqual(
+            self.env.get_template('page.html').render({'name': 'x'}),
+            'Hello x')
+
+        loader._next_check = 0
+        self.assertEqual(
+            self.env.get_template('page.html').render({'name': 'x'}),
+            'Bye x')
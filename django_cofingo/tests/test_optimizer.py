@@ -0,0 +1,164 @@
+import sys
+
+import jinja2
+from django.conf import settings
+from django.test import TestCase
+
+
+class TestOptimizer(TestCase):
+
+    def setUp(self):
+        from django_cofingo import env
+
+        settings.COFINGO_OPTIMIZE_TEMPLATES = True
+        self.templates = {
+            'base.html': '<title>{% block title %}Base{% endblock %}</title>'
+                         '{% block content %}{% endblock %}',
+            'middle.html': '{% extends "base.html" %}'
+                           '{% block content %}[{% block inner %}{% endblock %}]'
+                           '{% endblock %}',
+            'item.html': '{% set label = "#" ~ item %}<li>{{ label }}</li>',
+            'list.html': '{% extends "middle.html" %}'
+                         '{% block title %}List{% endblock %}'
+                         '{% block inner %}{% for item in items %}'
+                         '{% include "item.html" %}{% endfor %}'
+                         '{% endblock %}',
+            'label.html': '{% include "item.html" %}{{ label }}',
+            'super.html': '{% extends "base.html" %}'
+                          '{% block title %}{{ super() }}!{% endblock %}',
+            'fail.html': '<p>\n{{ fail() }}</p>',
+            'outer.html': '<div>\n\n{% include "fail.html" %}</div>',
+        }
+        self.env = env.overlay(loader=jinja2.FunctionLoader(self.load),
+                               auto_reload=True)
+        self.env._dependents = {}
+
+    def tearDown(self):
+        del settings.COFINGO_OPTIMIZE_TEMPLATES
+
+    def load(self, name):
+        source = self.templates.get(name)
+        if source is None:
+            return None
+        return source, name, lambda: self.templates.get(name) == source
+
+    def render(self, name, **context):
+        return self.env.get_template(name).render(context)
+
+    def test_inline(self):
+        from jinja2 import nodes
+
+        template = self.env.get_template('list.html')
+        self.assertEqual(template.render({'items': [1, 2]}),
+                         '<title>List</title>[<li>#1</li><li>#2</li>]')
+        self.assertEqual(
+            [name for name, checksum in template._dependencies],
+            ['base.html', 'item.html', 'middle.html'])
+
+        code = self.env.compile(self.templates['list.html'], 'list.html',
+                                raw=True)
+        self.assertFalse('get_template' in code)
+        self.assertEqual(sorted(template.blocks),
+                         ['content', 'inner', 'title'])
+        self.assertEqual(template.render_block('title'), 'List')
+
+        # parse() is left alone
+        ast = template._get_ast()
+        self.assertNotEqual(ast.find(nodes.Extends), None)
+        self.assertNotEqual(ast.find(nodes.Include), None)
+
+    def test_lint(self):
+        from django_cofingo.lint import lint_template
+
+        codes = [issue.code for issue in lint_template(self.env, 'list.html')]
+        self.assertTrue('C004' in codes)
+
+    def test_locations(self):
+        import traceback
+        from django_cofingo.debug import template_location
+
+        locations = []
+
+        def fail():
+            locations.append(template_location(sys._getframe(1)))
+            raise ZeroDivisionError
+
+        template = self.env.get_template('outer.html')
+        self.assertEqual(template._dependencies[0][0], 'fail.html')
+        try:
+            template.render({'fail': fail})
+        except ZeroDivisionError:
+            frames = traceback.extract_tb(sys.exc_info()[2])
+        else:
+            self.fail()
+        self.assertEqual(locations, [('fail.html', 2)])
+        self.assertEqual([(filename, lineno)
+                          for filename, lineno, function, text in frames
+                          if filename.endswith('.html')],
+                         [('fail.html', 2)])
+
+    def test_not_inlined(self):
+        from django_cofingo import Template
+        from django_cofingo.optimizer import source_checksum
+
+        template = self.env.get_template('super.html')
+        self.assertEqual(template.render({}),
+                         '<title>Base!</title>')
+        self.assertEqual(template._dependencies, ())
+
+        # item.html assigns label
+        template = self.env.get_template('label.html')
+        self.assertEqual(template.render({'item': 1, 'label': 'x'}),
+                         '<li>#1</li>x')
+        self.assertEqual(template._dependencies,
+                         (('item.html', source_checksum(
+                             self.templates['item.html'])),))
+
+        template = self.env.from_string('{% include "item.html" %}',
+                                        template_class=Template)
+        self.assertEqual(template.render({'item': 1}), '<li>#1</li>')
+        self.assertEqual(template._dependencies, ())
+
+    def test_changes(self):
+        template = self.env.get_template('list.html')
+        self.assertTrue(template.is_up_to_date)
+
+        self.templates['item.html'] = '<p>{{ item }}</p>'
+        self.assertFalse(template.is_up_to_date)
+        self.assertEqual(self.render('list.html', items=[1]),
+                         '<title>List</title>[<p>1</p>]')
+
+        self.templates['base.html'] = '{% block content %}{% endblock %}'
+        self.assertEqual(self.render('list.html', items=[1]), '[<p>1</p>]')
+
+    def test_invalidate(self):
+        self.env.auto_reload = False
+        self.render('list.html', items=[1])
+        self.templates['base.html'] = '{% block content %}{% endblock %}'
+        self.assertEqual(self.render('list.html', items=[1]),
+                         '<title>List</title>[<li>#1</li>]')
+
+        self.env.invalidate_template('base.html')
+        self.assertEqual(self.render('list.html', items=[1]),
+                         '[<li>#1</li>]')
+
+    def test_bytecode_cache(self):
+        from jinja2.bccache import BytecodeCache
+
+        class MemoryBytecodeCache(BytecodeCache):
+            storage = {}
+
+            def load_bytecode(self, bucket):
+                if bucket.key in self.storage:
+                    bucket.bytecode_from_string(self.storage[bucket.key])
+
+            def dump_bytecode(self, bucket):
+                self.storage[bucket.key] = bucket.bytecode_to_string()
+
+        self.env.bytecode_cache = MemoryBytecodeCache()
+        self.render('list.html', items=[1])
+        self.templates['item.html'] = '<p>{{ item }}</p>'
+
+        self.env.cache.clear()
+        self.assertEqual(self.render('list.html', items=[1]),
+                         '<title>List</title>[<p>1</p>]')
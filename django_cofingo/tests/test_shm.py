@@ -0,0 +1,102 @@
+import os
+import shutil
+import tempfile
+import time
+from multiprocessing import Process
+
+from django.conf import settings
+from django.test import TestCase
+
+
+def _set_in_process(cache, key, value):
+    cache.set(key, value)
+
+
+class TestSharedMemoryCache(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'fragments')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def get_cache(self, **options):
+        from django_cofingo.shm import SharedMemoryCache
+        return SharedMemoryCache(self.path, {'OPTIONS': options})
+
+    def test_get_set(self):
+        cache = self.get_cache()
+        self.assertEqual(cache.get('a'), None)
+        cache.set('a', u'\u2603')
+        cache.set('b', {'x': 1}, 60)
+        self.assertEqual(cache.get('a'), u'\u2603')
+        self.assertEqual(cache.get('b'), {'x': 1})
+
+        self.assertFalse(cache.add('a', 2))
+        self.assertTrue(cache.add('c', 2))
+        self.assertEqual(cache.incr('c', 3), 5)
+        self.assertEqual(cache.get('c'), 5)
+        self.assertRaises(ValueError, cache.incr, 'd')
+
+        cache.delete('a')
+        self.assertEqual(cache.get('a'), None)
+        cache.clear()
+        self.assertEqual(cache.get_many(['b', 'c']), {})
+
+    def test_expiry(self):
+        cache = self.get_cache()
+        cache.set('a', 1, -1)
+        self.assertEqual(cache.get('a'), None)
+        self.assertTrue(cache.add('a', 2))
+        self.assertEqual(cache.get('a'), 2)
+
+    def test_eviction(self):
+        # A single bucket of two slots
+        cache = self.get_cache(SLOTS=2, WAYS=2, SLOT_SIZE=128)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        time.sleep(0.01)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')),
+                         (1, None, 3))
+
+        # Too large values are not stored
+        cache.set('a', 'x' * 200)
+        self.assertEqual(cache.get('a'), None)
+
+    def test_shared(self):
+        from django.core.exceptions import ImproperlyConfigured
+
+        cache = self.get_cache()
+        process = Process(target=_set_in_process,
+                          args=(self.get_cache(), 'a', [1, 2]))
+        process.start()
+        process.join()
+        self.assertEqual(cache.get('a'), [1, 2])
+
+        self.assertRaises(ImproperlyConfigured,
+                          self.get_cache(SLOTS=16).get, 'a')
+
+    def test_fragment_cache(self):
+        from django_cofingo import env
+        from django_cofingo.cache import get_fragment_cache
+
+        caches = settings.CACHES
+        settings.CACHES = dict(caches, fragments={
+            'BACKEND': 'django_cofingo.shm.SharedMemoryCache',
+            'LOCATION': self.path,
+        })
+        settings.COFINGO_FRAGMENT_CACHE = 'fragments'
+        try:
+            template = env.from_string(
+                '{% cache 500 "shm" %}{{ x }}{% endcache %}')
+            self.assertEqual(template.render({'x': 1}), '1')
+            self.assertEqual(template.render({'x': 2}), '1')
+            self.assertEqual(self.get_cache().get(
+                'template.cache.shm.d41d8cd98f00b204e9800998ecf8427e'), '1')
+            get_fragment_cache().clear()
+        finally:
+            settings.CACHES = caches
+            del settings.COFINGO_FRAGMENT_CACHE
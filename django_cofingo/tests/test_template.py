@@ -0,0 +1,210 @@
+from django.conf import settings
+from django.test import TestCase
+
+
+def fail():
+    raise AssertionError('block should not be rendered')
+
+
+class TestRenderBlock(TestCase):
+
+    def test_render_block(self):
+        from django_cofingo import env
+        tmpl = env.get_template('fullstack_app/child.html')
+
+        result = tmpl.render_block('title', {'name': 'Child', 'content': fail})
+        self.assertEqual(result, 'Base - Child')
+
+    def test_render_parent_block(self):
+        from django_cofingo import env
+        tmpl = env.get_template('fullstack_app/child.html')
+
+        result = tmpl.render_block('content', {'content': lambda: 'foo'})
+        self.assertEqual(result, 'foo')
+
+    def test_render_block_top_level(self):
+        import jinja2
+        from django_cofingo import env
+
+        templates = {
+            'macros.html': '{% macro em(text) %}<em>{{ text }}</em>'
+                           '{% endmacro %}',
+            'base.html': '{% set site = "Site" %}'
+                         '{% block title %}{% endblock %}',
+            'page.html': '{% extends "base.html" %}'
+                         '{% import "macros.html" as macros %}'
+                         '{% from "macros.html" import em %}'
+                         '{% set page = "Page" %}'
+                         '{% macro strong(text) %}<b>{{ text }}</b>'
+                         '{% endmacro %}'
+                         '{% block title %}{{ macros.em(page) }}{{ em(site) }}'
+                         '{{ strong(name) }}{% endblock %}',
+        }
+        overlay = env.overlay(loader=jinja2.DictLoader(templates),
+                              cache_size=10)
+        tmpl = overlay.get_template('page.html')
+        self.assertEqual(tmpl.render_block('title', {'name': 'x'}),
+                         '<em>Page</em><em>Site</em><b>x</b>')
+
+    def test_render_unknown_block(self):
+        from jinja2.exceptions import TemplateRuntimeError
+        from django_cofingo import env
+        tmpl = env.get_template('fullstack_app/child.html')
+
+        with self.assertRaises(TemplateRuntimeError):
+            tmpl.render_block('sidebar')
+
+    def test_render_to_string(self):
+        from django.http import HttpRequest
+        from django_cofingo import render_to_string
+
+        result = render_to_string(
+            HttpRequest(), 'fullstack_app/child.html',
+            {'name': 'Child', 'content': fail}, block='title')
+        self.assertEqual(result, 'Base - Child')
+
+
+class TestRenderToStrings(TestCase):
+
+    def test_render_to_strings(self):
+        from django.http import HttpRequest
+        from django_cofingo import render_to_strings
+
+        contexts = ({'name': i} for i in range(5))
+        result = render_to_strings(
+            HttpRequest(), 'fullstack_app/hello.html', contexts)
+        self.assertEqual(list(result), ['Hello %d!' % i for i in range(5)])
+
+    def test_render_to_strings_processes(self):
+        from django_cofingo import render_to_strings
+
+        contexts = [{'name': i} for i in range(50)]
+        expected = ['Hello %d!' % i for i in range(50)]
+
+        result = render_to_strings(None, 'fullstack_app/hello.html', contexts,
+                                   processes=2, batch_size=20)
+        self.assertEqual(list(result), expected)
+
+        result = render_to_strings(None, 'fullstack_app/hello.html', contexts,
+                                   processes=2, ordered=False)
+        self.assertEqual(sorted(result), sorted(expected))
+
+    def test_render_to_strings_parallel(self):
+        from django_cofingo import env, render_to_strings
+
+        # The thread pool of the parallel tag exists before the fork
+        env.get_template('fullstack_app/parallel.html').render({'name': 0})
+        result = render_to_strings(None, 'fullstack_app/parallel.html',
+                                   [{'name': 1}, {'name': 2}], processes=2)
+        self.assertEqual([text.strip() for text in result],
+                         ['Hello 1!', 'Hello 2!'])
+
+    def test_render_to_strings_processes_request(self):
+        from django.test.client import RequestFactory
+        from django_cofingo import render_to_strings
+
+        result = render_to_strings(
+            RequestFactory().get('/'), 'fullstack_app/hello.html',
+            [{'name': 1}], processes=2)
+        self.assertRaises(ValueError, list, result)
+
+
+class TestImportCache(TestCase):
+
+    def setUp(self):
+        import jinja2
+        from django_cofingo import env
+
+        settings.COFINGO_IMPORT_CACHE_SIZE = 10
+        self.env = env.overlay(loader=jinja2.DictLoader({
+            'macros.html': '{% set counted = count() %}'
+                           '{% macro hello(name) %}'
+                           '{{ greeting }} {{ name }}{{ suffix }}'
+                           '{% endmacro %}',
+            'page.html': '{% import "macros.html" as m with context %}'
+                         '{{ m.hello(name) }}',
+            'from.html': '{% from "macros.html" import hello with context %}'
+                         '{{ hello(name) }}',
+            'include_macros.html': '{% macro show() %}'
+                                   '[{% include "inner.html" %}]'
+                                   '{% endmacro %}',
+            'inner.html': '{{ user }}',
+            'include.html': '{% import "include_macros.html" as m '
+                            'with context %}{{ m.show() }}',
+        }))
+
+    def tearDown(self):
+        del settings.COFINGO_IMPORT_CACHE_SIZE
+
+    def test_import_cache(self):
+        calls = []
+
+        def count():
+            calls.append(1)
+
+        template = self.env.get_template('page.html')
+        context = {'count': count, 'greeting': 'Hi', 'name': 'a'}
+        self.assertEqual(template.render(context), 'Hi a')
+        context['name'] = 'b'
+        self.assertEqual(template.render(context), 'Hi b')
+        self.assertEqual(len(calls), 1)
+
+        # A referenced variable changed
+        context['greeting'] = 'Hello'
+        self.assertEqual(template.render(context), 'Hello b')
+        self.assertEqual(len(calls), 2)
+
+    def test_passes_context(self):
+        # The include needs the whole context, the module is not cached
+        template = self.env.get_template('include.html')
+        self.assertEqual(template.render({'user': 'alice'}), '[alice]')
+        self.assertEqual(template.render({'user': 'bob'}), '[bob]')
+
+        # The module is shared by all templates which import it
+        template = self.env.get_template('from.html')
+        self.assertEqual(template.render(context), 'Hello b')
+        self.assertEqual(len(calls), 2)
+
+    def test_passes_context(self):
+        # The include needs the whole context, the module is not cached
+        template = self.env.get_template('include.html')
+        self.assertEqual(template.render({'user': 'alice'}), '[alice]')
+        self.assertEqual(template.render({'user': 'bob'}), '[bob]')
+
+
+class TestRenderTo(TestCase):
+
+    def test_render_to(self):
+        from StringIO import StringIO
+        from django_cofingo import env
+
+        class Stream(object):
+            def __init__(self):
+                self.writes = []
+
+            def write(self, data):
+                self.writes.append(data)
+
+        template = env.from_string(
+            u'{% for i in range(100) %}<p>\\u2603 {{ i }}</p>{% endfor %}')
+        stream = Stream()
+        template.render_to(stream, {}, buffer_size=100)
+        self.assertTrue(len(stream.writes) > 10)
+        self.assertTrue(all(type(data) is str for data in stream.writes))
+        self.assertEqual(''.join(stream.writes).decode('utf-8'),
+                         template.render({}))
+
+        stream = StringIO()
+        env.get_template('fullstack_app/hello.html').render_to(
+            stream, {'name': u'\\xe9'}, encoding='latin-1')
+        self.assertEqual(stream.getvalue(), 'Hello \\xe9!')
+
+    def test_render_to_response(self):
+        from django.http import HttpRequest
+        from django_cofingo import render_to_response
+
+        response = render_to_response(
+            HttpRequest(), 'fullstack_app/hello.html', {'name': 'x'},
+            status=201)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.content, 'Hello x!')
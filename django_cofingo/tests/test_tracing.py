@@ -0,0 +1,80 @@
+import json
+
+from django.conf import settings
+from django.test import TestCase
+
+
+class TestTracing(TestCase):
+
+    def setUp(self):
+        settings.COFINGO_TRACING = True
+
+    def tearDown(self):
+        del settings.COFINGO_TRACING
+
+    def test_trace(self):
+        from django_cofingo import env, tracing
+
+        test_env = env.overlay(cache_size=0)
+        template = test_env.get_template('fullstack_app/child.html')
+        content = test_env.from_string(
+            '{% cache 60 "traced" %}{% url the-index-view %}{% endcache %}')
+        with tracing.trace() as tracer:
+            template.render({'name': 'x', 'content': content.render})
+
+        events = dict((event['name'], event) for event in tracer.events)
+        for name in ['fullstack_app/child.html', 'fullstack_app/base.html',
+                     'block title', 'block content', 'url']:
+            self.assertTrue(name in events, name)
+        self.assertEqual(events['url']['args'], {'view': 'the-index-view'})
+        self.assertEqual(events['cache traced']['args'], {'hit': False})
+
+        # The parent template is rendered within the child template
+        child = events['fullstack_app/child.html']
+        parent = events['fullstack_app/base.html']
+        self.assertTrue(child['ts'] <= parent['ts'])
+        self.assertTrue(parent['ts'] + parent['dur'] <=
+                        child['ts'] + child['dur'])
+
+        data = json.loads(tracer.to_json())
+        self.assertEqual(len(data['traceEvents']), len(tracer.events))
+        self.assertEqual(data['traceEvents'][0]['ph'], 'X')
+
+    def test_not_tracing(self):
+        from django_cofingo import env, tracing
+
+        test_env = env.overlay(cache_size=0)
+        template = test_env.from_string('{% block a %}{{ x }}{% endblock %}')
+        self.assertEqual(template.render({'x': 1}), '1')
+        self.assertEqual(tracing.current(), None)
+
+    def test_middleware(self):
+        import os
+        import shutil
+        import tempfile
+        from django.http import HttpResponse
+        from django.test.client import RequestFactory
+        from django_cofingo import env
+        from django_cofingo.tracing import TracingMiddleware
+
+        settings.COFINGO_TRACING_DIR = tempfile.mkdtemp()
+        try:
+            middleware = TracingMiddleware()
+            request = RequestFactory().get('/news/')
+            middleware.process_request(request)
+            env.overlay(cache_size=0).get_template(
+                'fullstack_app/hello.html').render({'name': 'x'})
+            middleware.process_response(request, HttpResponse())
+
+            filenames = os.listdir(settings.COFINGO_TRACING_DIR)
+            self.assertEqual(len(filenames), 1)
+            self.assertTrue(filenames[0].endswith('-news.json'))
+            with open(os.path.join(settings.COFINGO_TRACING_DIR,
+                                   filenames[0])) as fh:
+                data = json.load(fh)
+            self.assertEqual(data['otherData']['path'], '/news/')
+            self.assertEqual(data['traceEvents'][0]['name'],
+                             'fullstack_app/hello.html')
+        finally:
+            shutil.rmtree(settings.COFINGO_TRACING_DIR)
+            del settings.COFINGO_TRACING_DIR
@@ -0,0 +1,211 @@
+"""Tracing of renders in the Chrome trace event format.
+
+With ``COFINGO_TRACING = True`` the templates are compiled with timing of
+their render functions and blocks, and the ``{% cache %}`` and ``{% url %}``
+tags are timed as well. The spans are recorded while a tracer is active in
+the current thread::
+
+    from django_cofingo import tracing
+
+    with tracing.trace() as tracer:
+        template.render(context)
+    tracer.save('render.json')
+
+The file can be opened in ``chrome://tracing`` or https://ui.perfetto.dev.
+Extends, includes and imports show up as the spans of the template they
+load, nested in the span of the template which loads them.
+
+To trace requests add ``django_cofingo.tracing.TracingMiddleware`` to your
+middleware, it writes a trace of a sample of the requests
+(``COFINGO_TRACING_SAMPLE_RATE``, default 1.0) to ``COFINGO_TRACING_DIR``.
+"""
+import json
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+_state = threading.local()
+
+
+def _now():
+    return time.time() * 1000000
+
+
+def current():
+    """Return the tracer which is active in the current thread."""
+    return getattr(_state, 'tracer', None)
+
+
+class Tracer(object):
+    """Collects spans as trace events."""
+
+    def __init__(self, metadata=None):
+        self.events = []
+        self.metadata = metadata or {}
+        self.pid = os.getpid()
+
+    def add(self, name, category, start, duration, args=None):
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': start,
+            'dur': duration,
+            'pid': self.pid,
+            'tid': threading.current_thread().ident,
+        }
+        if args:
+            event['args'] = args
+        self.events.append(event)
+
+    def to_dict(self):
+        return {
+            'traceEvents': sorted(self.events, key=lambda e: e['ts']),
+            'displayTimeUnit': 'ms',
+            'otherData': self.metadata,
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict())
+
+    def save(self, path):
+        with open(path, 'w') as fh:
+            fh.write(self.to_json())
+
+
+@contextmanager
+def trace(metadata=None):
+    """Trace the renders in the current thread, yields the :class:`Tracer`."""
+    previous = current()
+    tracer = _state.tracer = Tracer(metadata)
+    try:
+        yield tracer
+    finally:
+        _state.tracer = previous
+
+
+@contextmanager
+def use_tracer(tracer):
+    """Record the spans of the current thread with the given tracer, for
+    example the tracer of the thread which started a background task.
+    """
+    previous = current()
+    _state.tracer = tracer
+    try:
+        yield tracer
+    finally:
+        _state.tracer = previous
+
+
+class Span(object):
+    __slots__ = ('tracer', 'name', 'category', 'args', 'start')
+
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def set(self, key, value):
+        self.args[key] = value
+
+    def __enter__(self):
+        self.start = _now()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.tracer.add(self.name, self.category, self.start,
+                        _now() - self.start, self.args)
+
+
+class NullSpan(object):
+
+    def set(self, key, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        pass
+
+
+null_span = NullSpan()
+
+
+def span(name, category, **args):
+    """Time the with block if a tracer is active in the current thread."""
+    tracer = current()
+    if tracer is None:
+        return null_span
+    return Span(tracer, name, category, args)
+
+
+def _trace_render_func(func, name, category, args):
+    def traced_render_func(context):
+        tracer = current()
+        if tracer is None:
+            for event in func(context):
+                yield event
+            return
+        start = _now()
+        try:
+            for event in func(context):
+                yield event
+        finally:
+            tracer.add(name, category, start, _now() - start, args)
+    return traced_render_func
+
+
+def instrument(template, namespace):
+    """Wrap the render functions of a compiled template to record spans,
+    namespace is the module namespace of the compiled code.
+    """
+    template_name = template.name or '<string>'
+    template.root_render_func = _trace_render_func(
+        template.root_render_func, template_name, 'template',
+        {'template': template_name})
+
+    blocks = {}
+    for name, func in template.blocks.iteritems():
+        blocks[name] = _trace_render_func(func, 'block %s' % name, 'block',
+                                          {'template': template_name})
+        # super() looks up the block function by identity
+        if namespace.get('block_' + name) is func:
+            namespace['block_' + name] = blocks[name]
+    template.blocks = blocks
+    return template
+
+
+class TracingMiddleware(object):
+    """Writes a trace of the renders of a sample of the requests to the
+    COFINGO_TRACING_DIR directory.
+    """
+
+    def process_request(self, request):
+        rate = getattr(settings, 'COFINGO_TRACING_SAMPLE_RATE', 1.0)
+        if random.random() < rate:
+            request._cofingo_trace = trace({
+                'method': request.method,
+                'path': request.path,
+            })
+            request._cofingo_trace.__enter__()
+
+    def process_response(self, request, response):
+        context = getattr(request, '_cofingo_trace', None)
+        if context is None:
+            return response
+        tracer = current()
+        context.__exit__(None, None, None)
+        del request._cofingo_trace
+
+        if tracer is not None and tracer.events:
+            slug = re.sub(r'[^\w-]+', '-', request.path).strip('-')
+            filename = '%d-%s.json' % (time.time() * 1000, slug or 'index')
+            tracer.save(os.path.join(settings.COFINGO_TRACING_DIR, filename))
+        return response
@@ -1,9 +1,14 @@
 import datetime
+import threading
 
 import pytz
 from django.conf import settings
+from django.db.models import Q
+from django.db.models.fields import FieldDoesNotExist
+from django.db.models.query import ValuesListQuerySet, ValuesQuerySet
 from django.utils.safestring import EscapeData, SafeData
 from jinja2 import environmentfilter, Markup, Undefined
+from jinja2.utils import LRUCache
 
 if settings.TIME_ZONE:
     local_tzinfo = pytz.timezone(settings.TIME_ZONE)
@@ -79,6 +84,184 @@ def django_filter_to_jinja2(filter_func):
         def autoescape_wrapper(environment, *args, **kwargs):
             kwargs['autoescape'] = environment.autoescape
             return conversion_wrapper(*args, **kwargs)
-        return autoescape_wrapper
+        wrapper = autoescape_wrapper
     else:
-        return conversion_wrapper
+        wrapper = conversion_wrapper
+    # Used to recognize the wrapped filters, see django_cofingo.lint
+    wrapper.django_filter = filter_func
+    return wrapper
+
+
+class ChunkedQuerySet(object):
+    """Iterates over a queryset in chunks of ``chunk_size`` rows, without
+    caching the results on the queryset. See the ``chunked`` filter.
+
+    The chunks are paginated on the ordering of the queryset with the primary
+    key appended to break ties (keyset pagination), which keeps the queries
+    cheap for large tables and never skips or repeats a row. Querysets which
+    are ordered on nullable or related fields, or which have extra selects or
+    aggregates, are paginated with offsets instead.
+    """
+
+    def __init__(self, queryset, chunk_size=1000):
+        self.queryset = queryset
+        self.chunk_size = chunk_size
+        self._length = None
+
+    def __len__(self):
+        if self._length is None:
+            self._length = self.queryset.count()
+        return self._length
+
+    def __iter__(self):
+        queryset = self.queryset
+        query = queryset.query
+        if query.low_mark or query.high_mark is not None:
+            # Already sliced, Django can't slice it again.
+            return queryset.iterator()
+        key = self._get_key(queryset)
+        if key is None or query.extra or query.aggregates:
+            return self._iter_offset(queryset)
+        return self._iter_keyset(queryset, key)
+
+    def _get_key(self, queryset):
+        """Return the (field, descending) pairs the queryset is ordered on,
+        ending with the primary key, or None if they can't be paginated on.
+        """
+        query = queryset.query
+        opts = queryset.model._meta
+        ordering = query.order_by or \
+            (opts.ordering if query.default_ordering else [])
+
+        key = []
+        for name in ordering:
+            if not isinstance(name, basestring) or name == '?':
+                return None
+            descending = name.startswith('-')
+            name = name.lstrip('-')
+            if name == 'pk':
+                field = opts.pk
+            else:
+                try:
+                    field = opts.get_field(name)
+                except FieldDoesNotExist:
+                    return None
+                if field.rel is not None or field.null:
+                    return None
+            # reverse() flips the ordering
+            key.append((field, descending != (not query.standard_ordering)))
+            if field is opts.pk:
+                return key
+        key.append((opts.pk, not query.standard_ordering))
+        return key
+
+    def _iter_offset(self, queryset):
+        offset = 0
+        while True:
+            rows = 0
+            for rows, obj in enumerate(
+                    queryset[offset:offset + self.chunk_size].iterator(), 1):
+                yield obj
+            if rows < self.chunk_size:
+                return
+            offset += rows
+
+    def _iter_keyset(self, queryset, key):
+        queryset = queryset.order_by(*[
+            ('-' if descending else '') + field.name
+            for field, descending in key])
+        queryset.query.standard_ordering = True
+
+        names = [field.attname for field, descending in key]
+        if isinstance(queryset, ValuesQuerySet):
+            # Select the fields of the key as well, and strip them from the
+            # rows again.
+            fields = list(queryset.field_names)
+            extra = [name for name in names if name not in fields]
+            flat = getattr(queryset, 'flat', False)
+            values_list = isinstance(queryset, ValuesListQuerySet)
+            queryset = queryset._clone(klass=ValuesQuerySet, setup=True,
+                                       _fields=fields + extra)
+
+            def get_key(row):
+                return [row[name] for name in names]
+
+            def get_row(row):
+                if flat:
+                    return row[fields[0]]
+                if values_list:
+                    return tuple(row[name] for name in fields)
+                for name in extra:
+                    del row[name]
+                return row
+        else:
+            def get_key(obj):
+                return [getattr(obj, name) for name in names]
+
+            def get_row(obj):
+                return obj
+
+        chunk = queryset
+        while True:
+            rows, obj = 0, None
+            for rows, obj in enumerate(
+                    chunk[:self.chunk_size].iterator(), 1):
+                last = get_key(obj)
+                yield get_row(obj)
+            if rows < self.chunk_size:
+                return
+            chunk = queryset.filter(self._after(key, last))
+
+    def _after(self, key, values):
+        """Return the condition for the rows after the given key values."""
+        condition = None
+        equal = Q()
+        for (field, descending), value in zip(key, values):
+            lookup = '%s__%s' % (field.name, 'lt' if descending else 'gt')
+            after = equal & Q(**{lookup: value})
+            condition = after if condition is None else condition | after
+            equal &= Q(**{field.name: value})
+        return condition
+
+
+class TemplateCache(object):
+    """A bounded LRU cache of compiled templates which counts its hits,
+    misses and evictions, see ``Environment.from_string``.
+    """
+
+    def __init__(self, capacity):
+        self._cache = LRUCache(capacity)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def capacity(self):
+        return self._cache.capacity
+
+    def get(self, key):
+        template = self._cache.get(key)
+        with self._lock:
+            if template is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return template
+
+    def set(self, key, template):
+        with self._lock:
+            if key not in self._cache and \
+                    len(self._cache) >= self._cache.capacity:
+                self.evictions += 1
+            self._cache[key] = template
+
+    def clear(self):
+        self._cache.clear()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def __repr__(self):
+        return '<TemplateCache size=%d hits=%d misses=%d evictions=%d>' % (
+            len(self), self.hits, self.misses, self.evictions)
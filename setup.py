@@ -46,6 +46,7 @@ class RunTests(Command):
                     'django_cofingo',
                     'apps.urls_app',
                     'apps.fullstack_app',
+                    'apps.dbtemplates_app',
                 ],
                 TEMPLATE_LOADERS=[
                     'django_cofingo.Loader'